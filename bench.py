@@ -0,0 +1,242 @@
+"""benchmark functions"""
+import asyncio
+import html.parser
+import json
+import os
+import random
+import resource
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import markdown
+from dotenv import load_dotenv
+
+import sanitize
+from storage import Storage
+from watchwords import WatchwordMatcher, WatchwordRegistry
+
+
+def random_text(rng, word_count):
+    """Returns word_count random lowercase words separated by spaces"""
+    return " ".join("".join(
+        rng.choice(string.ascii_lowercase)
+        for _ in range(rng.randint(2, 9)))
+                    for _ in range(word_count))
+
+
+def bench_watchword_matcher():
+    """Compares WatchwordMatcher against the old per-keyword scan"""
+    rng = random.Random(0)
+    messages = [random_text(rng, rng.randint(5, 60)) for _ in range(200)]
+    for watchword_count in (100, 1000, 10000):
+        user_words = {}
+        for _ in range(watchword_count):
+            user_words[random_text(rng, rng.choice((1, 1, 1, 2, 3)))] = {}
+        matcher = WatchwordMatcher(user_words)
+
+        def old_scan():
+            for content in messages:
+                content_list = content.split()
+                found = set()
+                for keyword in user_words:
+                    if " " in keyword and keyword in content:
+                        found.add(keyword)
+                    elif " " not in keyword and keyword in content_list:
+                        found.add(keyword)
+
+        def new_scan():
+            for content in messages:
+                matcher.match(content, content.split())
+
+        old = min(timeit.repeat(old_scan, number=1, repeat=3))
+        new = min(timeit.repeat(new_scan, number=1, repeat=3))
+        print(f"{watchword_count:>6} watchwords: "
+              f"loop {old / len(messages) * 1e6:9.1f} us/message, "
+              f"matcher {new / len(messages) * 1e6:7.1f} us/message "
+              f"({old / new:.0f}x)")
+
+
+def bench_watchword_loading(row_count=100000):
+    """Compares startup loading of the old dict-of-dicts and the registry"""
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+
+        async def create():
+            db = Storage(path)
+            await db.connect()
+            await db.migrate()
+            await db.close()
+
+        asyncio.run(create())
+        conn = sqlite3.connect(path)
+        words = [
+            random_text(rng, rng.choice((1, 1, 2))) for _ in range(20000)
+        ]
+        conn.executemany(
+            "INSERT INTO watchword (guild_id, user_id, word, channels) "
+            "VALUES (1, ?, ?, ?);",
+            ((rng.randrange(2**60), rng.choice(words),
+              "[290695292964306948]" if rng.random() < 0.1 else None)
+             for _ in range(row_count)),
+        )
+        conn.commit()
+        conn.close()
+
+        async def old_load():
+            db = Storage(path)
+            await db.connect()
+            user_words = {}
+            matcher = WatchwordMatcher()
+            for user_id, word, channels in await db.fetchall(
+                    "SELECT user_id, word, channels FROM watchword "
+                    "WHERE guild_id = ?;", (1,)):
+                user_words.setdefault(word, {})[user_id] = {
+                    "channels": channels
+                }
+                matcher.add(word)
+            await db.close()
+            return user_words, matcher
+
+        async def new_load():
+            db = Storage(path)
+            await db.connect()
+            registry = WatchwordRegistry()
+            await registry.reload(db, 1)
+            await db.close()
+            return registry
+
+        for name, load in (("dict of dicts", old_load),
+                           ("registry", new_load)):
+            started = time.perf_counter()
+            asyncio.run(load())
+            elapsed = time.perf_counter() - started
+            # Measure memory on a second run, tracemalloc skews timings
+            tracemalloc.start()
+            loaded = asyncio.run(load())
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{name:>14}: {elapsed:.2f}s to load {row_count} rows, "
+                  f"{retained / 1024 / 1024:.1f} MiB retained, "
+                  f"{peak / 1024 / 1024:.1f} MiB peak")
+            del loaded
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Process max RSS: {max_rss / 1024:.0f} MiB")
+
+
+class LegacyJanitor(html.parser.HTMLParser):
+    """The old markdown-to-HTML-to-text MessageJanitor, for comparison"""
+
+    def __init__(self, message: str):
+        super().__init__()
+        self.message = message
+        self.replying = False
+        self.sanitized = []
+        self.feed(markdown.markdown(message))
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "reply":
+            self.sanitized.append("<reply>")
+            self.replying = True
+
+    def handle_data(self, data):
+        if not self.replying:
+            self.sanitized.append(data)
+
+    def get_data(self):
+        if "<reply>" in self.message:
+            offset = self.message.index("<reply>") + 6
+            self.sanitized.append(self.message[offset:])
+        return "".join(self.sanitized)
+
+
+def bench_sanitization():
+    """Compares MessageJanitor against the old markdown/HTMLParser pass"""
+    with open("bench_messages.json") as corpus:
+        messages = json.load(corpus)
+
+    def old_strip():
+        for message in messages:
+            LegacyJanitor(message).get_data()
+
+    def new_strip():
+        sanitize.strip_markdown.cache_clear()
+        for message in messages:
+            sanitize.MessageJanitor(message).get_data()
+
+    def cached_strip():
+        for message in messages:
+            sanitize.MessageJanitor(message).get_data()
+
+    same = sum(
+        LegacyJanitor(message).get_data().strip() ==
+        sanitize.MessageJanitor(message).get_data() for message in messages)
+    old = min(timeit.repeat(old_strip, number=10, repeat=3)) / 10
+    new = min(timeit.repeat(new_strip, number=10, repeat=3)) / 10
+    cached = min(timeit.repeat(cached_strip, number=10, repeat=3)) / 10
+    for name, elapsed in (("markdown + HTMLParser", old),
+                          ("tokenizer", new), ("tokenizer, cached", cached)):
+        print(f"{name:>21}: {elapsed / len(messages) * 1e6:7.1f} us/message "
+              f"({old / elapsed:.0f}x)")
+    print(f"Same text for {same} of {len(messages)} messages (the rest are "
+          "Discord-only markup and <reply>s the old parser mangled)")
+
+
+# Run in a fresh process per mode, so each RSS only counts that mode's caches
+STARTUP_SCRIPT = """
+import asyncio, resource, time
+started = time.perf_counter()
+import main
+
+@main.OMEGA.listen("on_ready")
+async def report_startup():
+    ready = time.perf_counter() - started
+    await asyncio.sleep(10)  # Let the rest of on_ready settle
+    print(ready, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+          sum(len(guild.members) for guild in main.OMEGA.guilds), flush=True)
+    await main.OMEGA.close()
+
+main.OMEGA.run(main.TOKEN)
+"""
+
+
+def bench_startup():
+    """Compares time to ready and RSS of the full and lean gateway modes"""
+    load_dotenv()
+    if not os.getenv("DISCORD_TOKEN"):
+        print("Skipped, needs DISCORD_TOKEN to log in")
+        return
+    for mode in ("full", "lean"):
+        result = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT],
+                                env={**os.environ, "GATEWAY_MODE": mode},
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True,
+                                timeout=600,
+                                check=False)
+        try:
+            ready, max_rss, members = result.stdout.split()[-3:]
+        except ValueError:
+            print(f"{mode:>5}: bot exited with {result.returncode} before "
+                  "reporting")
+            continue
+        print(f"{mode:>5}: ready in {float(ready):.1f}s, "
+              f"{int(max_rss) / 1024:.0f} MiB max RSS, "
+              f"{members} members cached")
+
+
+print("----------------------------------------------------------------------")
+print("Benchmarking watchword matching...")
+bench_watchword_matcher()
+print("Benchmarking watchword loading...")
+bench_watchword_loading()
+print("Benchmarking sanitization...")
+bench_sanitization()
+print("Benchmarking startup...")
+bench_startup()
+print("All done!")
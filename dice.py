@@ -0,0 +1,302 @@
+"""Dice expression parsing, bulk rolling and statistics for the roll command"""
+import functools
+import heapq
+import math
+import random
+import re
+
+MAX_DICE = 5000000  # Across every term and repeat of one expression
+MAX_SIDES = 1000000
+MAX_REPEAT = 100
+MAX_EXPLOSIONS = 100  # Rounds of rerolls for exploding dice
+DISPLAY_LIMIT = 100  # Terms with more dice than this only show their total
+STATS_DICE_BUDGET = 2000000
+NORMAL_APPROXIMATION = 1000  # Plain terms with more dice are sampled as normal
+MESSAGE_LIMIT = 2000
+
+TERM_PATTERN = re.compile(
+    r"\s*(?:(?P<count>\d*)d(?P<sides>\d+|%)(?P<explode>!)?"
+    r"(?:(?P<keep>kh|kl|k|dh|dl)(?P<keep_count>\d+))?"
+    r"|(?P<constant>\d+))\s*")
+SIGN_PATTERN = re.compile(r"\s*([+-])")
+REPEAT_PATTERN = re.compile(r"\s*(\d+)\s*x\s*")
+
+# Own generator, so commands that seed the global one (iq) can't fix rolls
+RNG = random.Random()
+
+
+class DiceError(ValueError):
+    """Raised for expressions that can't be parsed or are out of bounds"""
+
+
+class DiceTerm:
+    """One NdS group, ie 4d6kh3 or d20!"""
+
+    __slots__ = ("count", "sides", "explode", "keep", "keep_highest", "text")
+
+    def __init__(self, count, sides, explode, keep, keep_highest, text):
+        self.count = count
+        self.sides = sides
+        self.explode = explode
+        self.keep = keep  # Number of dice kept, or None to keep them all
+        self.keep_highest = keep_highest
+        self.text = text
+
+    @property
+    def plain(self):
+        return not self.explode and self.keep is None
+
+    def _rolls(self, rng):
+        faces = range(1, self.sides + 1)
+        rolls = rng.choices(faces, k=self.count)
+        if self.explode:
+            pending = rolls.count(self.sides)
+            for _ in range(MAX_EXPLOSIONS):
+                if not pending:
+                    break
+                extra = rng.choices(faces, k=pending)
+                rolls.extend(extra)
+                pending = extra.count(self.sides)
+        return rolls
+
+    def roll(self, rng=RNG):
+        """
+        Returns (total, rolls, dropped): rolls is None for terms too big to
+        display, and dropped holds the indexes of dice removed by keep/drop.
+        """
+        rolls = self._rolls(rng)
+        show = len(rolls) <= DISPLAY_LIMIT
+        if self.keep is None or self.keep >= len(rolls):
+            return sum(rolls), rolls if show else None, set()
+        if show:
+            order = sorted(range(len(rolls)),
+                           key=rolls.__getitem__,
+                           reverse=self.keep_highest)
+            dropped = set(order[self.keep:])
+            total = sum(roll for index, roll in enumerate(rolls)
+                        if index not in dropped)
+            return total, rolls, dropped
+        return self._kept_total(rolls), None, set()
+
+    def _kept_total(self, rolls):
+        drop = len(rolls) - self.keep
+        if self.keep_highest:
+            if self.keep <= drop:
+                return sum(heapq.nlargest(self.keep, rolls))
+            return sum(rolls) - sum(heapq.nsmallest(drop, rolls))
+        if self.keep <= drop:
+            return sum(heapq.nsmallest(self.keep, rolls))
+        return sum(rolls) - sum(heapq.nlargest(drop, rolls))
+
+    def sample_totals(self, samples: int, rng=RNG):
+        """Returns the totals of samples independent rolls of this term"""
+        if not self.plain:
+            return [
+                self._kept_total(rolls) if self.keep is not None and
+                self.keep < len(rolls) else sum(rolls)
+                for rolls in (self._rolls(rng) for _ in range(samples))
+            ]
+        if self.count > NORMAL_APPROXIMATION:
+            mean = self.count * (self.sides + 1) / 2
+            deviation = math.sqrt(self.count * (self.sides**2 - 1) / 12)
+            return [
+                min(max(round(rng.gauss(mean, deviation)), self.count),
+                    self.count * self.sides) for _ in range(samples)
+            ]
+        rolls = rng.choices(range(1, self.sides + 1), k=self.count * samples)
+        if self.count == 1:
+            return rolls
+        return [
+            sum(rolls[start:start + self.count])
+            for start in range(0, len(rolls), self.count)
+        ]
+
+
+class DiceExpression:
+    """A parsed expression of signed dice terms and constants, repeated"""
+
+    __slots__ = ("repeat", "terms", "text")
+
+    def __init__(self, repeat, terms, text):
+        self.repeat = repeat
+        self.terms = terms  # (sign, DiceTerm or int) pairs
+        self.text = text
+
+    @property
+    def dice_count(self):
+        return sum(term.count
+                   for _, term in self.terms
+                   if isinstance(term, DiceTerm))
+
+    @property
+    def sample_cost(self):
+        """Dice actually rolled per sample by sample_totals"""
+        return sum(
+            1 if term.plain and term.count > NORMAL_APPROXIMATION else
+            term.count for _, term in self.terms if isinstance(term, DiceTerm))
+
+    def roll(self, rng=RNG):
+        """Returns (total, [(sign, term, result)]) for one repetition"""
+        total = 0
+        parts = []
+        for sign, term in self.terms:
+            if isinstance(term, DiceTerm):
+                result = term.roll(rng)
+            else:
+                result = (term, None, set())
+            total += sign * result[0]
+            parts.append((sign, term, result))
+        return total, parts
+
+    def sample_totals(self, samples: int, rng=RNG):
+        """Returns the totals of samples independent rolls of the expression"""
+        totals = [0] * samples
+        for sign, term in self.terms:
+            if isinstance(term, DiceTerm):
+                totals = [
+                    total + sign * value for total, value in zip(
+                        totals, term.sample_totals(samples, rng))
+                ]
+            else:
+                totals = [total + sign * term for total in totals]
+        return totals
+
+
+@functools.lru_cache(maxsize=256)
+def parse(text: str) -> DiceExpression:
+    """Compiles a dice expression such as '6x4d6kh3 + 2d8 - 1'"""
+    source = text.lower().strip()
+    repeat = 1
+    position = 0
+    match = REPEAT_PATTERN.match(source)
+    if match:
+        repeat = int(match.group(1))
+        position = match.end()
+    terms = []
+    sign = 1
+    while True:
+        match = TERM_PATTERN.match(source, position)
+        if not match or match.end() == position:
+            raise DiceError(f"I couldn't understand '{source[position:]}'.")
+        position = match.end()
+        terms.append((sign, _term(match)))
+        if position == len(source):
+            break
+        match = SIGN_PATTERN.match(source, position)
+        if not match:
+            raise DiceError(f"I couldn't understand '{source[position:]}'.")
+        sign = 1 if match.group(1) == "+" else -1
+        position = match.end()
+    expression = DiceExpression(repeat, tuple(terms), source)
+    if not 1 <= repeat <= MAX_REPEAT:
+        raise DiceError(f"Please repeat a roll between 1 and {MAX_REPEAT} "
+                        "times.")
+    if expression.dice_count * repeat > MAX_DICE:
+        raise DiceError(f"Please roll at most {MAX_DICE} dice at once.")
+    return expression
+
+
+def _term(match):
+    if match.group("constant") is not None:
+        return int(match.group("constant"))
+    count = int(match.group("count") or 1)
+    sides = 100 if match.group("sides") == "%" else int(match.group("sides"))
+    if count < 1:
+        raise DiceError("Please roll at least one die.")
+    if not 2 <= sides <= MAX_SIDES:
+        raise DiceError("Please pick a number of sides between 2 and "
+                        f"{MAX_SIDES}.")
+    keep = None
+    keep_highest = True
+    mode = match.group("keep")
+    if mode:
+        amount = int(match.group("keep_count"))
+        if mode in ("kh", "k"):
+            keep = amount
+        elif mode == "kl":
+            keep, keep_highest = amount, False
+        elif mode == "dl":
+            keep = max(count - amount, 0)
+        else:  # dh
+            keep, keep_highest = max(count - amount, 0), False
+    return DiceTerm(count, sides, bool(match.group("explode")), keep,
+                    keep_highest, match.group().strip())
+
+
+def _format_part(sign, term, result, detailed):
+    prefix = "- " if sign < 0 else "+ "
+    if not isinstance(term, DiceTerm):
+        return f"{prefix}{term}"
+    total, rolls, dropped = result
+    if not detailed or rolls is None:
+        return f"{prefix}{term.text} ({total})"
+    shown = ", ".join(f"~~{roll}~~" if index in dropped else str(roll)
+                      for index, roll in enumerate(rolls))
+    return f"{prefix}{term.text} [{shown}]"
+
+
+def _format_roll(total, parts, detailed):
+    body = " ".join(
+        _format_part(sign, term, result, detailed)
+        for sign, term, result in parts)
+    return f"{total}: {body[2:] if body.startswith('+ ') else body}"
+
+
+def roll_text(text: str, rng=RNG) -> str:
+    """Rolls an expression and describes it in at most MESSAGE_LIMIT chars"""
+    expression = parse(text)
+    rolls = [expression.roll(rng) for _ in range(expression.repeat)]
+    if len(rolls) == 1 and len(expression.terms) == 1:
+        total, ((_, term, (_, dice, _)),) = rolls[0]
+        if isinstance(term, DiceTerm) and dice is not None and len(dice) == 1:
+            return f"You rolled: {dice}"
+    for detailed in (True, False):
+        if len(rolls) == 1:
+            answer = "You rolled " + _format_roll(*rolls[0], detailed)
+        else:
+            answer = f"You rolled {expression.text}:\n" + "\n".join(
+                f"{number}. " + _format_roll(*roll, detailed)
+                for number, roll in enumerate(rolls, 1))
+        if len(answer) <= MESSAGE_LIMIT:
+            return answer
+    lines = answer.splitlines()
+    kept = []
+    length = 0
+    for line in lines:
+        if length + len(line) + 1 > MESSAGE_LIMIT - 40:
+            break
+        kept.append(line)
+        length += len(line) + 1
+    if len(kept) < len(lines):
+        kept.append(f"...and {len(lines) - len(kept)} more")
+    return "\n".join(kept)[:MESSAGE_LIMIT]
+
+
+def stats_text(text: str, rng=RNG) -> str:
+    """Summarizes the distribution of an expression by simulation"""
+    expression = parse(text)
+    samples = min(10000, STATS_DICE_BUDGET // max(expression.sample_cost, 1))
+    if samples < 10:
+        raise DiceError("That's too many kept or exploding dice to simulate.")
+    totals = expression.sample_totals(samples, rng)
+    mean = sum(totals) / samples
+    deviation = math.sqrt(sum((total - mean)**2 for total in totals) / samples)
+    low, high = min(totals), max(totals)
+    span = high - low + 1
+    buckets = span if span <= 24 else 16
+    width = math.ceil(span / buckets)
+    counts = [0] * buckets
+    for total in totals:
+        counts[(total - low) // width] += 1
+    labels = [
+        str(start) if width == 1 else f"{start}-{start + width - 1}"
+        for start in range(low, low + buckets * width, width)
+    ]
+    label_width = max(map(len, labels))
+    lines = [
+        f"{label:>{label_width}} | {'█' * round(20 * count / max(counts))} "
+        f"{count / samples:.1%}" for label, count in zip(labels, counts)
+    ]
+    return (f"{expression.text} over {samples} rolls: mean {mean:.2f}, "
+            f"std dev {deviation:.2f}, min {low}, max {high}\n"
+            "```\n" + "\n".join(lines) + "\n```")
@@ -0,0 +1,44 @@
+"""Gateway intents and caching options for the full and lean modes"""
+import discord
+
+# Gateway intents each feature needs, beyond which lean mode asks for nothing
+FEATURE_INTENTS = {
+    "commands and the message pipeline": ("guilds", "guild_messages",
+                                          "dm_messages"),
+    "reaction rules, reports and watched paging": ("guild_reactions",
+                                                   "dm_reactions"),
+    # Role changes and departures of the cached watchword subscribers
+    "watchword recipient filtering": ("members",),
+    "pin and channel caches": ("guilds",),
+}
+LEAN_MAX_MESSAGES = 20  # Nothing needs discord.py's message cache in lean mode
+
+
+def lean_intents() -> discord.Intents:
+    """Returns only the intents the features above need"""
+    intents = discord.Intents.none()
+    for names in FEATURE_INTENTS.values():
+        for name in names:
+            setattr(intents, name, True)
+    return intents
+
+
+def gateway_options(mode: str, max_messages: int) -> dict:
+    """
+    Returns the Bot keyword arguments for a gateway mode.
+    "full" asks for every intent and caches every member at startup.
+    "lean" skips presences and other unused events, caches no members
+    except those fetched on purpose (see ChannelMemberIndex.cache_members)
+    and never chunks guilds, so startup and memory no longer grow with the
+    member count.
+    """
+    if mode == "full":
+        return {"intents": discord.Intents.all(), "max_messages": max_messages}
+    if mode == "lean":
+        return {
+            "intents": lean_intents(),
+            "member_cache_flags": discord.MemberCacheFlags.none(),
+            "chunk_guilds_at_startup": False,
+            "max_messages": min(max_messages, LEAN_MAX_MESSAGES),
+        }
+    raise ValueError(f"Unknown gateway mode {mode!r}, expected full or lean")
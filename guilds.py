@@ -0,0 +1,192 @@
+"""Per-guild configuration and state, partitioned so shards hold only theirs"""
+import logging
+
+from watchwords import WatchwordRegistry
+
+# Channel settings in the guild table, by the name the config command uses
+CHANNEL_SETTINGS = {
+    "mod": "mod_channel_id",
+    "playground": "playground_channel_id",
+    "silliness": "silliness_channel_id",
+}
+# Text settings for the cw command, set the same way
+CW_SETTINGS = {
+    "cw_rules": "cw_rules_url",
+    "cw_contact": "cw_contact",
+    "cw_role": "cw_role_name",
+}
+SETTINGS = {**CHANNEL_SETTINGS, **CW_SETTINGS}
+
+
+class GuildState:
+    """One guild's configuration, watchwords, radio channels and slowmode"""
+
+    __slots__ = ("guild_id", "mod_channel_id", "playground_channel_id",
+                 "silliness_channel_id", "cw_rules_url", "cw_contact",
+                 "cw_role_name", "watchwords", "radio_channels", "slowmode")
+
+    def __init__(self, guild_id, slowmode):
+        self.guild_id = guild_id
+        self.mod_channel_id = None
+        self.playground_channel_id = None
+        self.silliness_channel_id = None
+        self.cw_rules_url = None  # Where muted members can read the rules
+        self.cw_contact = None  # Who muted members should contact
+        self.cw_role_name = None  # The role that mutes them
+        self.watchwords = WatchwordRegistry()
+        self.radio_channels = set()  # IDs of channels in radio mode
+        self.slowmode = slowmode  # SlowmodeController for flagged channels
+
+
+class GuildStates:
+    """
+    The GuildState of every guild this process serves, loaded from the
+    guild and channel tables as guilds become available and dropped when
+    the bot leaves one. Under sharding each process only ever loads the
+    guilds on its own shards.
+    Handlers find their guild's state with one dict lookup, so the work per
+    message doesn't grow with the number of guilds.
+    make_slowmode() returns an empty SlowmodeController; its timer only
+    runs while the guild has slowmode channels.
+    """
+
+    def __init__(self, storage, writes, make_slowmode, get_channel):
+        self.storage = storage
+        self.writes = writes
+        self.make_slowmode = make_slowmode
+        self.get_channel = get_channel
+        self._states = {}  # guild id -> GuildState
+
+    def __len__(self):
+        return len(self._states)
+
+    def __iter__(self):
+        return iter(self._states.values())
+
+    def get(self, guild_id):
+        """Returns the guild's state, or None if it isn't loaded"""
+        return self._states.get(guild_id)
+
+    def state(self, guild_id: int) -> GuildState:
+        """Returns the guild's state, creating an empty one to load into"""
+        state = self._states.get(guild_id)
+        if state is None:
+            state = self._states[guild_id] = GuildState(
+                guild_id, self.make_slowmode())
+        return state
+
+    async def seed(self, guild_id: int, slowmode_channel_ids=(), **settings):
+        """
+        Stores a guild's initial configuration unless it already has one,
+        ie to carry a single-guild setup from environment variables over.
+        settings are column names of the guild table.
+        """
+        if await self.storage.fetchone(
+                "SELECT 1 FROM guild WHERE guild_id = ?;", (guild_id,)):
+            return
+        columns = ", ".join(("guild_id", *settings))
+        marks = ", ".join("?" * (len(settings) + 1))
+        await self.writes.write(
+            (f"INSERT OR IGNORE INTO guild ({columns}) VALUES ({marks});",
+             [(guild_id, *settings.values())]),
+            ("INSERT INTO channel (channel_id, guild_id, slowmode) "
+             "VALUES (?, ?, 1) ON CONFLICT (channel_id) DO UPDATE "
+             "SET slowmode = 1;",
+             [(channel_id, guild_id) for channel_id in slowmode_channel_ids]),
+        )
+        logging.info("Seeded configuration of guild %s", guild_id)
+
+    async def load(self, guild_id: int) -> GuildState:
+        """
+        Loads or refreshes a guild's state in place, so the watchword
+        registry keeps changes made while it reloads and slowmode windows
+        survive a reconnect.
+        """
+        state = self.state(guild_id)
+        row = await self.storage.fetchone(
+            f"SELECT {', '.join(SETTINGS.values())} FROM guild "
+            "WHERE guild_id = ?;", (guild_id,))
+        for column, value in zip(SETTINGS.values(),
+                                 row or (None,) * len(SETTINGS)):
+            setattr(state, column, value)
+        channels = await self.storage.fetchall(
+            "SELECT channel_id, radio, slowmode FROM channel "
+            "WHERE guild_id = ?;", (guild_id,))
+        state.radio_channels.clear()
+        state.radio_channels.update(
+            channel_id for channel_id, radio, _ in channels if radio)
+        slowmode_ids = {
+            channel_id for channel_id, _, slowmode in channels if slowmode
+        }
+        for channel_id in set(state.slowmode.windows) - slowmode_ids:
+            state.slowmode.unwatch(channel_id)
+        for channel_id in slowmode_ids:
+            state.slowmode.watch(channel_id)
+        self._restart_slowmode(state)
+        await state.watchwords.reload(self.storage, guild_id)
+        return state
+
+    def drop(self, guild_id: int):
+        """Forgets a guild the bot left"""
+        state = self._states.pop(guild_id, None)
+        if state is not None:
+            state.slowmode.stop()
+
+    def close(self):
+        for state in self._states.values():
+            state.slowmode.stop()
+
+    def _restart_slowmode(self, state):
+        if state.slowmode.windows:
+            state.slowmode.start(self.get_channel)
+        else:
+            state.slowmode.stop()
+
+    async def configure(self, guild_id: int, setting: str, value):
+        """Sets one of the SETTINGS, or clears it if value is None"""
+        column = SETTINGS[setting]
+        await self.writes.write((
+            f"INSERT INTO guild (guild_id, {column}) VALUES (?, ?) "
+            f"ON CONFLICT (guild_id) DO UPDATE SET {column} = excluded.{column};",
+            [(guild_id, value)],
+        ))
+        setattr(self.state(guild_id), column, value)
+
+    async def toggle_channel(self, channel, flag: str) -> bool:
+        """Flips a channel's radio or slowmode flag, returning the new value"""
+        state = self.state(channel.guild.id)
+        if flag == "radio":
+            enabled = channel.id not in state.radio_channels
+        else:
+            enabled = not state.slowmode.watches(channel.id)
+        await self.writes.write((
+            f"INSERT INTO channel (channel_id, guild_id, {flag}) "
+            f"VALUES (?, ?, ?) ON CONFLICT (channel_id) DO UPDATE "
+            f"SET {flag} = excluded.{flag};",
+            [(channel.id, channel.guild.id, enabled)],
+        ))
+        if flag == "radio":
+            if enabled:
+                state.radio_channels.add(channel.id)
+            else:
+                state.radio_channels.discard(channel.id)
+        else:
+            if enabled:
+                state.slowmode.watch(channel.id)
+            else:
+                state.slowmode.unwatch(channel.id)
+            self._restart_slowmode(state)
+        return enabled
+
+    async def mod_channel_id(self, guild_id: int):
+        """
+        Returns a guild's mod chat, reading it from the database if another
+        shard process owns the guild
+        """
+        state = self._states.get(guild_id)
+        if state is not None:
+            return state.mod_channel_id
+        row = await self.storage.fetchone(
+            "SELECT mod_channel_id FROM guild WHERE guild_id = ?;",
+            (guild_id,))
+        return row[0] if row else None
@@ -0,0 +1,97 @@
+"""Shared async HTTP client for Google, xkcd and GitHub calls"""
+import asyncio
+import logging
+import time
+import urllib.parse
+
+import aiohttp
+import ujson
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class HttpError(Exception):
+    """Raised when a request could not be completed, even after retries"""
+
+
+class HttpClient:
+    """
+    One pooled aiohttp session for the whole bot, so outbound calls never
+    block the event loop and reuse kept-alive connections.
+    Connections per host are capped, every request has a timeout,
+    and idempotent requests are retried with exponential backoff on
+    connection errors, timeouts and 429/5xx responses.
+    Given a Metrics, each attempt's latency is recorded per host as
+    http_request_seconds, and its outcome as http_responses_total.
+    """
+
+    def __init__(self,
+                 limit_per_host=4,
+                 timeout=10,
+                 retries=2,
+                 backoff=0.5,
+                 metrics=None):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics
+        self._session = None
+
+    async def start(self):
+        """Opens the session; safe to call more than once"""
+        if self._session is not None and not self._session.closed:
+            return
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self.limit_per_host),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def close(self):
+        """Closes the session and its pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, method: str, url: str, **kwargs):
+        """
+        Sends a request and returns (status, body), with body parsed as JSON
+        when possible and left as text otherwise.
+        Keyword arguments are passed through to aiohttp.
+        """
+        await self.start()
+        retries = self.retries if method.upper() in IDEMPOTENT_METHODS else 0
+        host = urllib.parse.urlsplit(url).hostname
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+            status = "error"
+            try:
+                async with self._session.request(method, url,
+                                                 **kwargs) as response:
+                    text = await response.text()
+                    status = response.status
+                    if (response.status not in RETRY_STATUSES or
+                            attempt == retries):
+                        try:
+                            return response.status, ujson.loads(text)
+                        except ValueError:
+                            return response.status, text
+                    logging.info("%s %s returned %s, retrying", method, url,
+                                 response.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                if attempt == retries:
+                    raise HttpError(
+                        f"{method} {url} failed: {error!r}") from error
+                logging.info("%s %s failed with %r, retrying", method, url,
+                             error)
+            finally:
+                if self.metrics is not None:
+                    self.metrics.observe("http_request_seconds",
+                                         time.perf_counter() - started,
+                                         host=host)
+                    self.metrics.increment("http_responses_total",
+                                           host=host,
+                                           status=status)
+            await asyncio.sleep(self.backoff * 2**attempt)
+        raise HttpError(f"{method} {url} failed")
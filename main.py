@@ -1,42 +1,150 @@
 """General-purpose Discord bot designed for SlateStarCodex Discord server"""
+import asyncio
 import datetime
-import html.parser
 import logging
 import os
 import random
 import re
-import sqlite3
-import string
 import time
-from abc import ABC
 
 import discord
-import markdown
-import requests
 import ujson
 from discord.ext import commands
 from dotenv import load_dotenv
 
+import dice
+from gateway import gateway_options
+from guilds import CHANNEL_SETTINGS, CW_SETTINGS, SETTINGS, GuildStates
+from http_client import HttpClient, HttpError
+from members import ChannelMemberIndex
+from metrics import Metrics
+from notifier import MessageDispatcher, pack_messages
+from pins import PIN_LIMIT, PinCache
+from pipeline import MessagePipeline, ProcessedMessage, normalize
+from reactions import ReactionRules, emoji_name
+from reports import ReportQueue, quote
+from search import LinkCorpus, SearchCache, XkcdService
+from slowmode import SlowmodeController
+from snipes import SnipeLog
+from storage import Storage, WriteBatcher
+from suggest import CommandIndex
+from watchwords import CooldownThrottle
+
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 
+
+def env_ids(name, default=""):
+    """Reads a comma-separated list of Discord IDs from the environment"""
+    return [int(item) for item in os.getenv(name, default).split(",") if item]
+
+
+def env_shard_ids(name):
+    """Reads shard IDs like "0,1,2" or "0-2" from the environment"""
+    value = os.getenv(name, "")
+    if "-" in value:
+        first, last = value.split("-")
+        return list(range(int(first), int(last) + 1))
+    return env_ids(name) or None
+
+
 # Initialize global variables
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
-SERVER_ID = int(os.getenv("DISCORD_SERVER_ID"))
+# The single-guild setup: its channels below seed that guild's configuration
+# the first time, and DM modmail goes to its mod chat
+SERVER_ID = int(os.getenv("DISCORD_SERVER_ID", "0"))
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GITHUB_PAT = os.getenv("GITHUB_PAT")
 REPO_OWNER = os.getenv("REPO_OWNER")
 REPO_NAME = os.getenv("REPO_NAME")
-MOD_CHAT = int(os.getenv("MOD_CHANNEL_ID"))
-PLAYGROUND = int(os.getenv("BOT_PLAYGROUND_CHANNEL_ID"))
-OMEGA = commands.Bot(command_prefix="!o ",
-                     intents=discord.Intents.all(),
-                     case_insensitive=True)
-OMEGA.conn = None
-OMEGA.cur = None
+MOD_CHAT = int(os.getenv("MOD_CHANNEL_ID", "0")) or None
+PLAYGROUND = int(os.getenv("BOT_PLAYGROUND_CHANNEL_ID", "0")) or None
+SILLINESS = int(os.getenv("SILLINESS_CHANNEL_ID", "465999263059673088"))
+CW_RULES_URL = os.getenv(
+    "CW_RULES_URL", "https://discord.com/channels/289207224075812864/"
+    "465999263059673088/764871448929107998") or None
+CW_CONTACT = os.getenv("CW_CONTACT", "Bolas#6942") or None
+CW_ROLE_NAME = os.getenv("CW_ROLE_NAME", "No-Nonsense") or None
+DM_CONCURRENCY = int(os.getenv("DM_CONCURRENCY", "5"))
+DM_COALESCE_SECONDS = float(os.getenv("DM_COALESCE_SECONDS", "2"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "86400"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_PERSIST = os.getenv("SEARCH_CACHE_PERSIST", "1") == "1"
+# Seeds DISCORD_SERVER_ID's slowmode channels, later toggled with !o slowmode
+SLOWMODE_CHANNEL_IDS = env_ids("SLOWMODE_CHANNEL_IDS", "290695292964306948")
+# ZorbaTHut#4936 in #workshop, keeping the sticky post Zorba made at the start
+PINBOT_USER_IDS = set(env_ids("PINBOT_USER_IDS", "180974399543967744"))
+PINBOT_CHANNEL_IDS = set(env_ids("PINBOT_CHANNEL_IDS", "832840713758441494"))
+PINBOT_STICKY_IDS = set(env_ids("PINBOT_STICKY_IDS", "832841374809849877"))
+AUTO_INVOKE_TYPOS = os.getenv("AUTO_INVOKE_TYPOS", "1") == "1"
+# Set METRICS_PORT to serve Prometheus text at http://METRICS_HOST:port/metrics
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# The snipe log keeps deleted and edited content, so discord.py's own cache
+# of whole Message objects can stay small
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "100"))
+# "lean" requests only the intents our features use and caches few members
+GATEWAY_MODE = os.getenv("GATEWAY_MODE", "full")
+# To split the bot over processes, give each the total SHARD_COUNT, its own
+# SHARD_IDS and its own METRICS_PORT; by default one process runs every shard
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = env_shard_ids("SHARD_IDS")
+if SHARD_IDS and SHARD_COUNT is None:
+    raise ValueError("SHARD_IDS needs SHARD_COUNT, the total number of shards "
+                     "across every process")
+SNIPE_LOG_BYTES = int(os.getenv("SNIPE_LOG_BYTES", str(8 * 1024 * 1024)))
+SNIPE_RECENT_MESSAGES = int(os.getenv("SNIPE_RECENT_MESSAGES", "5000"))
+
+
+class Omega(commands.AutoShardedBot):
+    """
+    Bot that times every command and releases its HTTP session, database
+    and metrics endpoint on shutdown
+    """
+
+    async def invoke(self, ctx):
+        started = time.perf_counter()
+        await super().invoke(ctx)
+        name = ctx.command.qualified_name if ctx.command else "unknown"
+        self.metrics.observe("command_seconds",
+                             time.perf_counter() - started,
+                             command=name)
+        if ctx.command_failed:
+            self.metrics.increment("command_errors_total", command=name)
+
+    async def close(self):
+        self.guild_states.close()
+        await self.dispatcher.close()
+        await self.metrics.close()
+        await self.http_client.close()
+        await self.db.close()
+        await super().close()
+
+
+OMEGA = Omega(command_prefix="!o ",
+              case_insensitive=True,
+              shard_count=SHARD_COUNT,
+              shard_ids=SHARD_IDS,
+              **gateway_options(GATEWAY_MODE, MESSAGE_CACHE_SIZE))
+OMEGA.metrics = Metrics()
+OMEGA.http_client = HttpClient(metrics=OMEGA.metrics)
+OMEGA.db = Storage("omega.db", metrics=OMEGA.metrics)
+OMEGA.writes = WriteBatcher(OMEGA.db)
+OMEGA.search_cache = SearchCache(
+    ttl=SEARCH_CACHE_TTL,
+    max_size=SEARCH_CACHE_SIZE,
+    writes=OMEGA.writes if SEARCH_CACHE_PERSIST else None,
+)
+OMEGA.scott_links = LinkCorpus("scott_links.txt")
+OMEGA.xkcd = XkcdService(OMEGA.http_client)
 OMEGA.inventory_size = 20
-OMEGA.user_words = {}
+OMEGA.watchword_import_limit = 10000
+OMEGA.watchword_throttle = CooldownThrottle()
+OMEGA.pipeline = MessagePipeline(OMEGA.metrics)
+OMEGA.channel_members = ChannelMemberIndex()
+OMEGA.dispatcher = MessageDispatcher(concurrency=DM_CONCURRENCY,
+                                     coalesce_window=DM_COALESCE_SECONDS)
 OMEGA.shut_up_durations = {
     "for a bit": ("be back in a minute.", 60),
     "for a while": ("be back in five or so.", 300),
@@ -45,9 +153,11 @@ OMEGA.shut_up_durations = {
 OMEGA.shut_up_til = datetime.datetime.now() - datetime.timedelta(
     seconds=5)  # Five seconds ago
 OMEGA.parting_shot = False
-OMEGA.logs = {}
 OMEGA.logs_max = 100
-OMEGA.slowmode_check_frequency = 600
+OMEGA.logs = SnipeLog(per_channel=OMEGA.logs_max,
+                      max_bytes=SNIPE_LOG_BYTES,
+                      recent_max=SNIPE_RECENT_MESSAGES)
+OMEGA.slowmode_window = 600
 OMEGA.slowmode_time_configs = {
     30: 600,
     26.25: 300,
@@ -58,74 +168,97 @@ OMEGA.slowmode_time_configs = {
     7.5: 10,
     3.75: 5,
 }
-OMEGA.message_cache = 0
-OMEGA.user_cache = set()
-OMEGA.last_updated = 0
-
-
-class MessageJanitor(html.parser.HTMLParser, ABC):
-    """
-    Class to strip text out of HTML,
-    to be used to strip the text out of the Markdown-turned-HTML.
-    Make sure not to strip out HTML-looking markup, ie <reply>.
-    """
-
-    def __init__(self, message: str):
-        super().__init__()
-        self.reset()
-
-        self.message = message
-        self.replying = False
-        self.sanitized = []
-
-        # Start the sanitizing
-        self.feed(markdown.markdown(message))
-
-    def handle_starttag(self, tag, attrs):
-        # Not very long-term if planning to add more attributes.
-        if tag == "reply":
-            self.sanitized.append("<reply>")
-            self.replying = True
-
-    def handle_data(self, data):
-        if not self.replying:
-            self.sanitized.append(data)
-
-    def get_data(self):
-        """
-        If is a tidbit, then keep the markdown for the rest of the message.
-        """
-        if "<reply>" in self.message:
-            offset = self.message.index("<reply>") + 6
-            self.sanitized.append(self.message[offset:])
-        return "".join(self.sanitized)
+OMEGA.pin_cache = PinCache()
+OMEGA.command_index = CommandIndex()
+OMEGA.reports = ReportQueue(OMEGA.db, OMEGA.writes)
+OMEGA.guild_states = GuildStates(
+    OMEGA.db, OMEGA.writes,
+    lambda: SlowmodeController((), OMEGA.slowmode_time_configs,
+                               window=OMEGA.slowmode_window),
+    OMEGA.get_channel)
+OMEGA.metrics.gauge("guilds", lambda: len(OMEGA.guild_states))
+OMEGA.metrics.gauge(
+    "watchwords", lambda: sum(len(state.watchwords)
+                              for state in OMEGA.guild_states))
+OMEGA.metrics.gauge(
+    "watchword_subscriptions",
+    lambda: sum(state.watchwords.subscription_count
+                for state in OMEGA.guild_states))
+OMEGA.metrics.gauge("watchword_notifications_allowed",
+                    lambda: OMEGA.watchword_throttle.allowed)
+OMEGA.metrics.gauge("watchword_notifications_throttled",
+                    lambda: OMEGA.watchword_throttle.throttled)
+OMEGA.metrics.gauge("channel_member_cache_hits",
+                    lambda: OMEGA.channel_members.hits)
+OMEGA.metrics.gauge("channel_member_cache_rebuilds",
+                    lambda: OMEGA.channel_members.rebuilds)
+OMEGA.metrics.gauge("channel_member_fetches",
+                    lambda: OMEGA.channel_members.fetched)
+OMEGA.metrics.gauge("cached_members",
+                    lambda: sum(len(guild.members) for guild in OMEGA.guilds))
+OMEGA.metrics.gauge("dispatcher_sent", lambda: OMEGA.dispatcher.sent)
+OMEGA.metrics.gauge("dispatcher_failed", lambda: OMEGA.dispatcher.failed)
+OMEGA.metrics.gauge("dispatcher_coalesced", lambda: OMEGA.dispatcher.coalesced)
+OMEGA.metrics.gauge("db_write_transactions", lambda: OMEGA.writes.transactions)
+OMEGA.metrics.gauge("db_write_statements", lambda: OMEGA.writes.statements)
+OMEGA.metrics.gauge("search_cache_entries", lambda: len(OMEGA.search_cache))
+OMEGA.metrics.gauge("search_cache_hits", lambda: OMEGA.search_cache.hits)
+OMEGA.metrics.gauge("search_cache_misses", lambda: OMEGA.search_cache.misses)
+OMEGA.metrics.gauge(
+    "slowmode_edits", lambda: sum(state.slowmode.edits
+                                  for state in OMEGA.guild_states))
+OMEGA.metrics.gauge("pin_cache_seeds", lambda: OMEGA.pin_cache.seeds)
+OMEGA.metrics.gauge(
+    "radio_channels", lambda: sum(len(state.radio_channels)
+                                  for state in OMEGA.guild_states))
+OMEGA.metrics.gauge("reports", lambda: OMEGA.reports.reports)
+OMEGA.metrics.gauge("reports_duplicate", lambda: OMEGA.reports.duplicates)
+OMEGA.metrics.gauge("report_posts", lambda: OMEGA.reports.posts)
+OMEGA.metrics.gauge("report_edits", lambda: OMEGA.reports.edits)
+OMEGA.metrics.gauge("snipe_log_entries", lambda: len(OMEGA.logs))
+OMEGA.metrics.gauge("snipe_log_bytes", lambda: OMEGA.logs.bytes)
 
 
 @OMEGA.event
 async def on_ready():
     """Initialization"""
-    OMEGA.conn = sqlite3.connect("omega.db")
-    OMEGA.cur = OMEGA.conn.cursor()
+    await OMEGA.db.connect()
     logging.info("Connected to omega.db")
-    OMEGA.cur.executescript(open("tables.sql").read())
-    OMEGA.conn.commit()
+    await OMEGA.http_client.start()
+    OMEGA.xkcd.start()
+    OMEGA.metrics.start()
+    if METRICS_PORT:
+        await OMEGA.metrics.serve(METRICS_HOST, METRICS_PORT)
+    logging.info("Database at schema version %s", await OMEGA.db.migrate())
+    if SEARCH_CACHE_PERSIST and not len(OMEGA.search_cache):
+        await OMEGA.search_cache.load(OMEGA.db)
+    OMEGA.scott_links.refresh()
     logging.info("Logged in as %s (%s)", OMEGA.user.name, OMEGA.user.id)
     # Ignore self, or else Omega would respond to himself
     logging.info("Adding user: %s, id: %s to ignore list", OMEGA.user.name,
                  OMEGA.user.id)
-    OMEGA.cur.execute(
+    await OMEGA.db.execute(
         "INSERT OR IGNORE INTO user (user_id, ignoramus) VALUES (?, ?);",
         (OMEGA.user.id, True),
     )
-    OMEGA.conn.commit()
-    OMEGA.cur.execute(
-        "SELECT user_id, word, channels FROM watchword where guild_id = (?);",
-        (SERVER_ID,),
-    )
-    word_data = OMEGA.cur.fetchall()
-    for triplet in word_data:
-        channels = ujson.loads(triplet[2]) if triplet[2] else []
-        OMEGA.user_words[triplet[1]] = {triplet[0]: {"channels": channels}}
+    if SERVER_ID:
+        await OMEGA.guild_states.seed(
+            SERVER_ID,
+            slowmode_channel_ids=SLOWMODE_CHANNEL_IDS,
+            mod_channel_id=MOD_CHAT,
+            playground_channel_id=PLAYGROUND,
+            silliness_channel_id=SILLINESS,
+            cw_rules_url=CW_RULES_URL,
+            cw_contact=CW_CONTACT,
+            cw_role_name=CW_ROLE_NAME,
+        )
+    for guild in OMEGA.guilds:
+        await load_guild(guild)
+    logging.info("Loaded %s guilds on shards %s", len(OMEGA.guild_states),
+                 sorted(OMEGA.shards))
+    OMEGA.reaction_rules.self_id = OMEGA.user.id
+    OMEGA.command_index.rebuild(OMEGA.commands)
+    await OMEGA.reports.load()
     await OMEGA.change_presence(activity=discord.Activity(
         type=discord.ActivityType.watching,
         name="- react 📢 to report a post, "
@@ -134,16 +267,46 @@ async def on_ready():
     logging.info("Bot initialization complete.")
 
 
+async def load_guild(guild):
+    """Loads a guild's state and caches its watchword subscribers"""
+    state = await OMEGA.guild_states.load(guild.id)
+    logging.info("Loaded %s subscriptions to %s watchwords in %s",
+                 state.watchwords.subscription_count, len(state.watchwords),
+                 guild)
+    await OMEGA.channel_members.cache_members(
+        guild, state.watchwords.subscriber_ids())
+
+
+@OMEGA.listen("on_guild_join")
+async def join_guild(guild):
+    """Starts serving a new guild"""
+    await load_guild(guild)
+
+
+@OMEGA.listen("on_guild_remove")
+async def leave_guild(guild):
+    """Forgets a guild the bot was removed from"""
+    OMEGA.guild_states.drop(guild.id)
+    OMEGA.channel_members.invalidate_guild(guild.id)
+
+
+def watchwords_of(guild):
+    """Returns the guild's watchword registry"""
+    return OMEGA.guild_states.state(guild.id).watchwords
+
+
 # Checks
 def is_in_playground(ctx):
     """Returns True if called from bot playground channel"""
-    return ctx.channel == OMEGA.get_channel(PLAYGROUND)
+    return (ctx.guild is not None and ctx.channel.id ==
+            OMEGA.guild_states.state(ctx.guild.id).playground_channel_id)
 
 
 # Checks
 def is_in_silliness(ctx):
     """Returns True if called from silliness channel"""
-    return ctx.channel == OMEGA.get_channel(465999263059673088)
+    return (ctx.guild is not None and ctx.channel.id ==
+            OMEGA.guild_states.state(ctx.guild.id).silliness_channel_id)
 
 
 # Commands
@@ -156,7 +319,7 @@ async def rat_search(ctx, *args):
     """Grabs an SSC article at random if no arguments,
     else results of a Google search"""
     logging.info("search command invocation: %s", args)
-    await ctx.send(search_helper(args, "7e281d64bc7d22cb7"))
+    await ctx.send(await search_helper(args, "7e281d64bc7d22cb7"))
 
 
 @OMEGA.command(
@@ -165,14 +328,15 @@ async def rat_search(ctx, *args):
     "(based on the arguments provided or random otherwise)",
 )
 async def scott_search(ctx, *args):
-    """Grabs an SSC article at random if no arguments,
-    else results of a Google search"""
+    """Grabs an SSC article at random if no arguments, else the best match
+    from scott_links.txt, falling back to a Google search"""
     logging.info("scott command invocation: %s", args)
     if args:
-        await ctx.send(search_helper(args, "2befc5589b259ca98"))
+        matches = OMEGA.scott_links.search(args)
+        await ctx.send(matches[0] if matches else await
+                       search_helper(args, "2befc5589b259ca98"))
     else:
-        await ctx.send(
-            random.choice(open("scott_links.txt").read().splitlines()))
+        await ctx.send(OMEGA.scott_links.random())
 
 
 @OMEGA.command(
@@ -185,26 +349,68 @@ async def xkcd_search(ctx, *args):
     else results of a Google search"""
     logging.info("xkcd command invocation: %s", args)
     if args:
-        await ctx.send(search_helper(args, "e58fafa0a295b814c"))
+        await ctx.send(await search_helper(args, "e58fafa0a295b814c"))
     else:
-        await ctx.send(
-            f"http://xkcd.com/{random.randint(1, requests.get(f'http://xkcd.com/info.0.json').json().get('num'))}"
-        )
+        await ctx.send(await OMEGA.xkcd.random_url() or
+                       "Couldn't reach xkcd right now.")
 
 
-def search_helper(args, pseid):
+async def search_helper(args, pseid):
     """Logic for the search commands"""
     query = " ".join(f'"{arg}"' if " " in arg else arg for arg in args)
+    try:
+        return await OMEGA.search_cache.get(
+            pseid, query, lambda: google_search(query, pseid))
+    except HttpError as error:
+        logging.warning("Search request failed: %s", error)
+        return "Search is unavailable right now."
+
+
+async def google_search(query, pseid):
+    """
+    Returns the top Custom Search result for query. Raises HttpError on
+    anything but a 200, so quota and key errors are never cached as misses.
+    """
     response = "No matches found."
+    params = {"key": GOOGLE_API_KEY, "cx": pseid, "q": query}
+    status, results = await OMEGA.http_client.request(
+        "GET",
+        "https://www.googleapis.com/customsearch/v1",
+        # aiohttp rejects None values, ie when GOOGLE_API_KEY is unset
+        params={name: value for name, value in params.items()
+                if value is not None},
+    )
+    if status != 200:
+        raise HttpError(f"Custom Search returned {status}")
     try:
-        response = requests.get("https://www.googleapis.com/customsearch/v1"
-                                f"?key={GOOGLE_API_KEY}&cx={pseid}&q={query}"
-                               ).json()["items"][0]["link"]
-    except KeyError:
+        response = results["items"][0]["link"]
+    except (KeyError, TypeError):
         pass
     return response
 
 
+@OMEGA.command(name="search_cache",
+               help="Shows search cache statistics",
+               hidden=True)
+@commands.has_permissions(administrator=True)
+async def search_cache_stats(ctx):
+    """Reports search cache hit/miss/eviction counts"""
+    cache = OMEGA.search_cache
+    await ctx.send(
+        f"Search cache: {len(cache)}/{cache.max_size} entries, "
+        f"TTL {cache.ttl}s\n"
+        f"Hits: {cache.hits}, misses: {cache.misses}, "
+        f"shared in-flight: {cache.shared}\n"
+        f"Evictions: {cache.evictions}, expirations: {cache.expirations}")
+
+
+@search_cache_stats.error
+async def search_cache_stats_error(ctx, error):
+    """Error handling for search_cache command"""
+    if isinstance(error, commands.errors.MissingPermissions):
+        await ctx.send("Sorry, you lack the permissions to run this command.")
+
+
 @OMEGA.command(
     name="iq",
     help="Takes a username, "
@@ -240,9 +446,12 @@ async def estimate_iq(ctx, *args):
 async def estimate_iq_error(ctx, error):
     """Error function for IQ command"""
     if isinstance(error, commands.errors.CheckAnyFailure):
+        playground = (ctx.guild and OMEGA.guild_states.state(
+            ctx.guild.id).playground_channel_id)
         await ctx.send(
             "Sorry, you lack any of the roles required to run this command "
-            f"outside of {OMEGA.get_channel(PLAYGROUND).mention}. ")
+            "outside of "
+            f"{f'<#{playground}>' if playground else 'the bot playground'}. ")
 
 
 @OMEGA.command(
@@ -256,11 +465,11 @@ async def create_github_issue(
     """Creates a Github issue (for bug reports and feature requests)"""
     issue = " ".join(list(args))
     logging.info("dev command invocation: %s", issue)
-    answer = create_github_issue_helper(ctx, issue)
+    answer = await create_github_issue_helper(ctx, issue)
     await ctx.send(answer)
 
 
-def create_github_issue_helper(ctx, issue):
+async def create_github_issue_helper(ctx, issue):
     """Logic for dev command"""
     url = f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/issues"
     headers = dict(Authorization=f"token {GITHUB_PAT}",
@@ -270,13 +479,19 @@ def create_github_issue_helper(ctx, issue):
         "body": f"Issue created by {ctx.message.author}.",
     }
     payload = ujson.dumps(data)
-    response = requests.request("POST", url, data=payload, headers=headers)
-    if response.status_code == 201:
+    try:
+        status, response = await OMEGA.http_client.request("POST",
+                                                           url,
+                                                           data=payload,
+                                                           headers=headers)
+    except HttpError as error:
+        return f"Could not create Issue: '{issue}'\n Response: {error}"
+    if status == 201:
         answer = (f"Successfully created Issue: '{issue}'\n"
                   "You can add more detail here: "
-                  f"{response.json()['html_url']}")
+                  f"{response['html_url']}")
     else:
-        answer = f"Could not create Issue: '{issue}'\n Response: {response.content}"
+        answer = f"Could not create Issue: '{issue}'\n Response: {response}"
     return answer
 
 
@@ -288,52 +503,33 @@ async def create_github_issue_error(ctx, error):
             "Sorry, you lack any of the roles required to run this command.")
 
 
-@OMEGA.command(name="roll", help="Accepts rolls in the form #d#")
-async def roll_dice(ctx,
-                    arg: commands.clean_content(fix_channel_mentions=True)):
-    """Rolls #d# dice"""
-    roll = arg.lower().split("d")
-    logging.info("dice command invocation: %s", roll)
-    answer = roll_dice_helper(roll)
+@OMEGA.command(
+    name="roll",
+    help="Rolls dice expressions like 3d6, 4d6kh3 + 2d8 - 1, d20! or 6x4d6kh3"
+    " (kh/kl keep the highest/lowest, dh/dl drop them, ! explodes, Nx repeats"
+    f").\n`{OMEGA.command_prefix}roll stats 3d6` simulates the distribution "
+    "instead.")
+async def roll_dice(ctx, *args: commands.clean_content(
+        fix_channel_mentions=True)):
+    """Rolls a dice expression, or summarizes it with a leading 'stats'"""
+    logging.info("dice command invocation: %s", args)
+    stats = bool(args) and args[0].lower() == "stats"
+    text = " ".join(args[1:] if stats else args)
+    # Big rolls take a moment, keep them off the event loop
+    answer = await asyncio.get_running_loop().run_in_executor(
+        None, roll_dice_helper, text, stats)
     await ctx.send(answer)
 
 
-def roll_dice_helper(roll):
+def roll_dice_helper(text, stats=False):
     """Logic for roll command"""
-    if len(roll) != 2:
-        answer = (
-            "Your format should be '#d#', with the first '#' representing how "
-            "many dice you'd like to roll and the second '#' representing the "
-            "number of sides on the die.")
-        return answer
-    if roll[0] == "":
-        roll[0] = 1
     try:
-        roll = (int(roll[0]), int(roll[1]))
-    except ValueError:
-        answer = (
-            "Your format should be '#d#', with the first '#' representing how "
-            "many dice you'd like to roll and the second '#' representing the "
-            "number of sides on the die.")
-        return answer
-    if roll[0] < 1 or roll[0] > 100:
-        answer = (
-            "Your format should be '#d#' with the first '#' representing how "
-            "many dice you'd like to roll. Please pick a number between 1 and "
-            "100 for it. ")
-        return answer
-    if roll[1] < 2 or roll[1] > 1000000:
-        answer = (
-            "Your format should be '#d#' with the second '#' representing the "
-            "number of sides on the die. Please pick a number between 2 and "
-            "1000000 for it. ")
-        return answer
-    results = [(random.randint(1, roll[1])) for _ in range(roll[0])]
-    answer = f"You rolled: {results}"
-    if len(results) > 1:
-        total = sum(results)
-        answer = f"You rolled {total}: {results}"
-    return answer
+        return dice.stats_text(text) if stats else dice.roll_text(text)
+    except dice.DiceError as error:
+        return (f"{error} Your format should be '#d#', with the first '#' "
+                "representing how many dice you'd like to roll and the second "
+                "'#' representing the number of sides on the die, ie '3d6' or "
+                "'4d6kh3 + 2d8 - 1'.")
 
 
 @OMEGA.command(
@@ -347,22 +543,21 @@ async def watchword(ctx, word, *args):
     """Adds user, word, and server to a dictionary
     to be notified on matching message"""
 
-    words = [word] + list(args)
     words = [
-        word.lower().translate(str.maketrans("", "", string.punctuation))
-        for word in words
+        normalize(word) for word in [word] + list(args)
+        if not re.fullmatch(r"<#\d+>", word)
     ]
     logging.info("watchword command invocation: %s", word)
-    logging.info(
-        "Current value for %s in dictionary prior to add: %s",
-        word,
-        OMEGA.user_words.get(word, -1),
-    )
     if not ctx.message.guild:
         await ctx.send(
             "This operation does not work in private message contexts.")
         return
-    if not word or word.startswith(OMEGA.command_prefix):
+    logging.info(
+        "Current value for %s in dictionary prior to add: %s",
+        word,
+        watchwords_of(ctx.guild).subscribers(word),
+    )
+    if not any(words) or word.startswith(OMEGA.command_prefix):
         await ctx.send(
             "That command contains an error. The syntax is as follows:\n"
             f'`{OMEGA.command_prefix} watchword "lorem ipsum"`\n'
@@ -371,33 +566,89 @@ async def watchword(ctx, word, *args):
             "such as those beginning with a bot prefix, "
             "are automatically rejected.")
         return
-    for word in words:
-        if word not in OMEGA.user_words:
-            OMEGA.user_words[word] = dict()
-        if ctx.message.author.id in OMEGA.user_words[word]:
-            await ctx.send(f'You are already watching "{word}"')
+    added, already = await register_watchwords(
+        ctx.message.guild.id,
+        ctx.message.author.id,
+        words,
+        [channel.id for channel in ctx.message.channel_mentions],
+    )
+    replies = [f'You are already watching "{word}"' for word in already]
+    replies.extend(
+        f"You are now watching this server for {word}." for word in added)
+    for reply in pack_messages(replies, separator="\n"):
+        await ctx.send(reply)
+
+
+async def register_watchwords(guild_id, user_id, words, channels=None):
+    """
+    Stores every new word for the user in one transaction,
+    then adds them to the in-memory registry.
+    If channels (a list of channel IDs) is given, only those channels
+    will trigger notifications for these words.
+    Returns the added words and the ones the user was already watching.
+    """
+    registry = OMEGA.guild_states.state(guild_id).watchwords
+    added, already = [], []
+    for word in dict.fromkeys(words):
+        if not word:
             continue
-        OMEGA.user_words[word][ctx.message.author.id] = dict()
+        if registry.is_watching(word, user_id):
+            already.append(word)
+        else:
+            added.append(word)
+    if not added:
+        return added, already
+    await OMEGA.writes.write(
+        ("INSERT OR IGNORE INTO user (user_id) VALUES (?);", [(user_id,)]),
+        (
+            "INSERT INTO watchword (guild_id, user_id, word, channels) "
+            "VALUES (?, ?, ?, ?);",
+            [(guild_id, user_id, word,
+              ujson.dumps(channels) if channels else None) for word in added],
+        ),
+    )
+    for word in added:
+        registry.add(word, user_id, channels)
+    guild = OMEGA.get_guild(guild_id)
+    if guild is not None:
+        await OMEGA.channel_members.cache_members(guild, (user_id,))
+    logging.info("Added %s watchwords for user %s", len(added), user_id)
+    return added, already
 
-        OMEGA.cur.execute(
-            "SELECT EXISTS(SELECT 1 FROM user WHERE user_id=?);",
-            (ctx.message.author.id,),
-        )
-        if not OMEGA.cur.fetchone():
-            OMEGA.cur.execute("INSERT INTO user (user_id) VALUES (?);",
-                              (ctx.message.author.id,))
-            OMEGA.conn.commit()
-        OMEGA.cur.execute(
-            "INSERT INTO watchword (guild_id, user_id, word) VALUES (?, ?, ?);",
-            (ctx.message.guild.id, ctx.message.author.id, word),
-        )
-        OMEGA.conn.commit()
-        logging.info(
-            "Added word if not present. Current value for %s in dictionary: %s",
-            word,
-            OMEGA.user_words[word],
-        )
-        await ctx.send(f"You are now watching this server for {word}.")
+
+@OMEGA.command(
+    name="import_watchwords",
+    help="Start watching every word or phrase in an attached text file, "
+    "one per line.",
+    aliases=["watch_import"],
+)
+async def import_watchwords(ctx):
+    """Bulk-adds watchwords from an attached file in a single transaction"""
+    logging.info("import_watchwords command invocation")
+    if not ctx.message.guild:
+        await ctx.send(
+            "This operation does not work in private message contexts.")
+        return
+    if not ctx.message.attachments:
+        await ctx.send("Attach a text file with one word or phrase per line.")
+        return
+    try:
+        text = (await ctx.message.attachments[0].read()).decode("utf-8")
+    except UnicodeDecodeError:
+        await ctx.send("That file doesn't look like UTF-8 text.")
+        return
+    words = [
+        normalize(line).strip() for line in text.splitlines()
+    ]
+    words = [word for word in words if word]
+    if len(words) > OMEGA.watchword_import_limit:
+        await ctx.send("Please import at most "
+                       f"{OMEGA.watchword_import_limit} words/phrases at once.")
+        return
+    added, already = await register_watchwords(ctx.message.guild.id,
+                                               ctx.message.author.id, words)
+    await ctx.send(f"You are now watching this server for {len(added)} new "
+                   f"words/phrases ({len(already)} were already watched).")
 
 
 @OMEGA.command(
@@ -407,17 +658,18 @@ async def watchword(ctx, word, *args):
 )
 async def delete_watchword(ctx, word):
     """Removes user/word/server combo from watchword notification dictionary"""
-    word = word.lower().translate(str.maketrans("", "", string.punctuation))
+    word = normalize(word)
+    if not ctx.message.guild:
+        await ctx.send(
+            "This operation does not work in private message contexts.")
+        return
+    registry = watchwords_of(ctx.guild)
     logging.info(
         "del_watchword command invocation: %s\n"
         "Current value for that word in dictionary: %s",
         word,
-        OMEGA.user_words[word],
+        registry.subscribers(word),
     )
-    if not ctx.message.guild:
-        await ctx.send(
-            "This operation does not work in private message contexts.")
-        return
     if not word or word.startswith(OMEGA.command_prefix):
         await ctx.send(
             "That command contains an error. The syntax is as follows:\n"
@@ -427,30 +679,66 @@ async def delete_watchword(ctx, word):
             "such as those beginning with a bot prefix, "
             "are automatically rejected.")
         return
-    OMEGA.cur.execute(
+    await OMEGA.writes.write((
         "DELETE FROM watchword WHERE guild_id = ? "
         "AND user_id = ? AND word = ?;",
-        (ctx.message.guild.id, ctx.message.author.id, word),
-    )
-    OMEGA.conn.commit()
-    if word in OMEGA.user_words and ctx.message.author.id in OMEGA.user_words[
-            word]:
-        del OMEGA.user_words[word][ctx.message.author.id]
+        [(ctx.message.guild.id, ctx.message.author.id, word)],
+    ))
+    if registry.remove(word, ctx.message.author.id):
         await ctx.send(f"You are no longer watching this server for {word}.")
         logging.info(
             "Removed word. Current value for %s in dictionary: %s",
             word,
-            OMEGA.user_words.get(word, -1),
+            registry.subscribers(word),
         )
     else:
         await ctx.send(f"You were not watching this server for {word}.")
         logging.info(
             "Did not detect word. Current value for %s in dictionary: %s",
             word,
-            OMEGA.user_words[word],
+            registry.subscribers(word),
         )
 
 
+WATCHED_PAGE_SIZE = 25
+WATCHED_TIMEOUT = 120  # Seconds the page buttons keep working
+EMBED_DESCRIPTION_LIMIT = 2048
+PREVIOUS_PAGE, NEXT_PAGE = "⬅️", "➡️"
+
+
+async def watched_page(user_id, guild_id, after=""):
+    """
+    Returns the user's watchwords on the guild that sort after the given
+    word, as many as fit one embed page, and whether more follow.
+    Seeks on the (user_id, guild_id, word) index instead of an OFFSET.
+    """
+    rows = await OMEGA.db.fetchall(
+        "SELECT word FROM watchword WHERE user_id = ? AND guild_id = ? "
+        "AND word > ? ORDER BY word LIMIT ?;",
+        (user_id, guild_id, after, WATCHED_PAGE_SIZE + 1),
+    )
+    words = []
+    length = 0
+    for (word,) in rows[:WATCHED_PAGE_SIZE]:
+        length += len(word) + 3  # Quotes and newline
+        if words and length > EMBED_DESCRIPTION_LIMIT:
+            break
+        words.append(word)
+    return words, len(words) < len(rows)
+
+
+def watched_embed(author, words, page, total):
+    """Builds one page of the watched listing"""
+    embed = discord.Embed(
+        title=f"{author.name}'s watched words/phrases",
+        description="\n".join(f'"{word}"'
+                               for word in words)[:EMBED_DESCRIPTION_LIMIT],
+        color=int("B37AE8", 16),
+    )
+    embed.set_footer(text=f"Page {page} · {total} watched on this server")
+    return embed
+
+
 @OMEGA.command(help="Replies with a list of all your watchwords on this server."
               )
 async def watched(ctx):
@@ -460,14 +748,97 @@ async def watched(ctx):
         await ctx.send(
             "This operation does not work in private message contexts.")
         return
-    OMEGA.cur.execute("SELECT word FROM watchword WHERE user_id=?;",
-                      (ctx.message.author.id,))
-    result = OMEGA.cur.fetchall()
-    watched_str = ""
-    for watched_word in result:
-        watched_str += '"' + watched_word[0] + '", '
-    watched_str = watched_str[:-2]
-    await ctx.send(f"{ctx.author.name}'s watched words/phrases:\n{watched_str}")
+    user_id, guild_id = ctx.author.id, ctx.guild.id
+    (total,) = await OMEGA.db.fetchone(
+        "SELECT COUNT(*) FROM watchword WHERE user_id = ? AND guild_id = ?;",
+        (user_id, guild_id))
+    if not total:
+        await ctx.send("You aren't watching any words or phrases on this "
+                       "server.")
+        return
+    starts = [""]  # The word each page seen so far starts after
+    words, more = await watched_page(user_id, guild_id)
+    message = await ctx.send(embed=watched_embed(ctx.author, words, 1, total))
+    if not more:
+        return
+    await message.add_reaction(PREVIOUS_PAGE)
+    await message.add_reaction(NEXT_PAGE)
+
+    # Raw events, so paging works even once the message leaves the cache
+    def is_page_turn(payload):
+        return (payload.user_id == ctx.author.id and
+                payload.message_id == message.id and
+                str(payload.emoji) in (PREVIOUS_PAGE, NEXT_PAGE))
+
+    while True:
+        try:
+            payload = await OMEGA.wait_for("raw_reaction_add",
+                                           check=is_page_turn,
+                                           timeout=WATCHED_TIMEOUT)
+        except asyncio.TimeoutError:
+            break
+        try:
+            await message.remove_reaction(payload.emoji, ctx.author)
+        except discord.HTTPException:
+            pass
+        if str(payload.emoji) == NEXT_PAGE and more:
+            starts.append(words[-1])
+        elif str(payload.emoji) == PREVIOUS_PAGE and len(starts) > 1:
+            starts.pop()
+        else:
+            continue
+        words, more = await watched_page(user_id, guild_id, starts[-1])
+        await message.edit(
+            embed=watched_embed(ctx.author, words, len(starts), total))
+    try:
+        await message.clear_reactions()
+    except discord.HTTPException:
+        pass
+
+
+@OMEGA.command(help="Reloads all watchwords from the database", hidden=True)
+@commands.has_permissions(administrator=True)
+async def reload_watchwords(ctx):
+    """Rebuilds the server's watchword registry without restarting the bot"""
+    logging.info("reload_watchwords command invocation")
+    if not ctx.message.guild:
+        await ctx.send(
+            "This operation does not work in private message contexts.")
+        return
+    started = time.perf_counter()
+    registry = watchwords_of(ctx.guild)
+    await registry.reload(OMEGA.db, ctx.guild.id)
+    await ctx.send(
+        f"Reloaded {registry.subscription_count} subscriptions to "
+        f"{len(registry)} watchwords in "
+        f"{time.perf_counter() - started:.2f}s, using about "
+        f"{registry.memory_footprint() / 1024 / 1024:.1f} MiB.")
+
+
+@reload_watchwords.error
+async def reload_watchwords_error(ctx, error):
+    """Error handling for reload_watchwords command"""
+    if isinstance(error, commands.errors.MissingPermissions):
+        await ctx.send("Sorry, you lack the permissions to run this command.")
+
+
+@OMEGA.command(name="stats",
+               help="Shows listener, command, database and HTTP metrics",
+               hidden=True,
+               aliases=["pipeline"])
+@commands.has_permissions(administrator=True)
+async def bot_stats(ctx):
+    """Reports everything the metrics registry has recorded"""
+    for reply in pack_messages(OMEGA.metrics.report().splitlines(),
+                               separator="\n"):
+        await ctx.send(reply)
+
+
+@bot_stats.error
+async def bot_stats_error(ctx, error):
+    """Error handling for stats command"""
+    if isinstance(error, commands.errors.MissingPermissions):
+        await ctx.send("Sorry, you lack the permissions to run this command.")
 
 
 @OMEGA.command(help="Bans user with provided reason.")
@@ -537,24 +908,34 @@ async def ban_error(ctx, error):
 @OMEGA.command(help="Mutes user in #silliness", hidden=True)
 @commands.has_permissions(manage_messages=True)
 async def cw(ctx, member: discord.Member):
-    if ctx.channel != OMEGA.get_channel(465999263059673088):
+    if not is_in_silliness(ctx):
         await ctx.send("This command can only be run in #silliness.")
         return
+    state = OMEGA.guild_states.state(ctx.guild.id)
+    role = (discord.utils.get(member.guild.roles, name=state.cw_role_name)
+            if state.cw_role_name else None)
+    if role is None:
+        await ctx.send(
+            "No mute role found, set its name with "
+            f"`{OMEGA.command_prefix}config cw_role <role name>`.")
+        return
+    lines = [f"You have been muted in #{ctx.channel.name} for posting CW "
+             "content."]
+    if state.cw_contact:
+        lines.append(f"Contact {state.cw_contact} with any questions.")
+    if state.cw_rules_url:
+        lines.append(f"See {state.cw_rules_url} for more information.")
     try:
-        await member.send(
-            "You have been muted in #silliness for posting CW content. "
-            "Contact Bolas#6942 and see https://discord.com/channels/289207224075812864/465999263059673088/764871448929107998 for more information."
-        )
+        await member.send(" ".join(lines))
         logging.info("CW ban message has been sent to user: %s", member.name)
     except discord.Forbidden:
         logging.info(
             "CW ban message not sent to user %s, because they have the bot blocked.",
             member.name,
         )
-    await member.add_roles(
-        discord.utils.get(member.guild.roles, name="No-Nonsense"))
-    await ctx.send(
-        f"{member.name} has been muted in #silliness for posting CW content.")
+    await member.add_roles(role)
+    await ctx.send(f"{member.name} has been muted in #{ctx.channel.name} for "
+                   "posting CW content.")
 
 
 @cw.error
@@ -572,25 +953,19 @@ async def cw_error(ctx, error):
 @commands.has_permissions(manage_messages=True)
 async def radio(ctx):
     """Puts a channel into bot-enforced text-only mode"""
-    logging.info("radio command invocation: %s", ctx.channel.name)
-    await ctx.send(radio_helper(ctx.channel))
+    logging.info("radio command invocation: %s", ctx.channel)
+    if not ctx.message.guild:
+        await ctx.send(
+            "This operation does not work in private message contexts.")
+        return
+    await ctx.send(await radio_helper(ctx.channel))
 
 
-def radio_helper(channel):
+async def radio_helper(channel):
     """Logic for radio command"""
-    OMEGA.cur.execute("SELECT EXISTS(SELECT 1 FROM radio WHERE channel_id=?);",
-                      (channel.id,))
-    if OMEGA.cur.fetchall()[0][0]:
-        OMEGA.cur.execute("DELETE FROM radio WHERE channel_id=?;",
-                          (channel.id,))
-        OMEGA.conn.commit()
-        answer = "Radio mode is now off in this channel."
-    else:
-        OMEGA.cur.execute("INSERT INTO radio (channel_id) VALUES (?);",
-                          (channel.id,))
-        OMEGA.conn.commit()
-        answer = "Radio mode is now on in this channel."
-    return answer
+    if await OMEGA.guild_states.toggle_channel(channel, "radio"):
+        return "Radio mode is now on in this channel."
+    return "Radio mode is now off in this channel."
 
 
 @radio.error
@@ -600,156 +975,285 @@ async def radio_error(ctx, error):
         await ctx.send("Sorry, you lack the permissions to run this command.")
 
 
-# @OMEGA.listen("on_command_error")
-# async def on_command_error(ctx, error):
-#     """Error handling for nonexistent commands"""
-#     if isinstance(error, commands.CommandNotFound):
-#         command_list = []
-#         command_names = []
-#         for command in OMEGA.walk_commands():
-#             command_list.append(command)
-#             command_names.append(command.name)
-#             if command.aliases:
-#                 command_names.extend(command.aliases)
-#         (prefix, attempt, *args) = ctx.message.content.split()
-#         distance, closest = min(
-#             (textdistance.damerau_levenshtein.distance(attempt, elem), elem)
-#             for elem in command_names
-#         )
-#         response = (
-#             "A command was attempted to be invoked "
-#             f"but no command under that name ({attempt}) is found. "
-#         )
-#         response += (
-#             f'I think you meant "{prefix} {closest} {" ".join(args)}" '
-#             # "- attempting to invoke that command now." TODO: Make this work
-#             if distance < 2
-#             else f'Did you mean "{prefix} {closest} {" ".join(args)}"?'
-#             if distance == 2
-#             else ""
-#         )
-#         await ctx.send(response)
-#         if distance < 2:
-#             await ctx.invoke(OMEGA.get_command(closest)(" ".join(args)))
+@OMEGA.command(help="Toggle automatic slowmode in this channel", hidden=True)
+@commands.has_permissions(manage_channels=True)
+async def slowmode(ctx):
+    """Puts a channel under or takes it out of automatic slowmode"""
+    logging.info("slowmode command invocation: %s", ctx.channel)
+    if not ctx.message.guild:
+        await ctx.send(
+            "This operation does not work in private message contexts.")
+        return
+    if await OMEGA.guild_states.toggle_channel(ctx.channel, "slowmode"):
+        await ctx.send("Automatic slowmode is now on in this channel.")
+    else:
+        await ctx.send("Automatic slowmode is now off in this channel.")
+
+
+@slowmode.error
+async def slowmode_error(ctx, error):
+    """Error handling for slowmode command"""
+    if isinstance(error, commands.errors.MissingPermissions):
+        await ctx.send("Sorry, you lack the permissions to run this command.")
+
+
+def describe_setting(setting, value):
+    """Formats a guild setting's value for the config command"""
+    if value is None:
+        return "not set"
+    if setting in CW_SETTINGS:
+        return value
+    return f"<#{value}>"
+
+
+@OMEGA.command(
+    name="config",
+    help="Shows this server's settings, or sets one, ie "
+    f"`{OMEGA.command_prefix}config mod #mod-chat` or "
+    f"`{OMEGA.command_prefix}config cw_role Muted`. Settings: "
+    f"{', '.join(SETTINGS)}; pass `none` to clear one.",
+    hidden=True,
+)
+@commands.has_permissions(administrator=True)
+async def configure_guild(ctx, setting=None, *, value=None):
+    """Reads or changes the guild table's settings for this server"""
+    logging.info("config command invocation: %s %s", setting, value)
+    if not ctx.message.guild:
+        await ctx.send(
+            "This operation does not work in private message contexts.")
+        return
+    state = OMEGA.guild_states.state(ctx.guild.id)
+    if setting is None:
+        await ctx.send("\n".join(
+            f"{name}: " + describe_setting(name, getattr(state, column))
+            for name, column in SETTINGS.items()))
+        return
+    if setting not in SETTINGS:
+        await ctx.send(f"Unknown setting {setting}, try one of: "
+                       f"{', '.join(SETTINGS)}.")
+        return
+    if value is None or value.lower() == "none":
+        value = None
+    elif setting in CHANNEL_SETTINGS:
+        if not ctx.message.channel_mentions:
+            await ctx.send("Mention the channel, ie #general, or pass none.")
+            return
+        value = ctx.message.channel_mentions[0].id
+    await OMEGA.guild_states.configure(ctx.guild.id, setting, value)
+    await ctx.send(f"{setting} is now {describe_setting(setting, value)}.")
+
+
+@configure_guild.error
+async def configure_guild_error(ctx, error):
+    """Error handling for config command"""
+    if isinstance(error, commands.errors.MissingPermissions):
+        await ctx.send("Sorry, you lack the permissions to run this command.")
+
+
+@OMEGA.pipeline.handler
+async def radio_mode_message(processed: ProcessedMessage):
+    """Deletes messages with attachments in radio channels"""
+    message = processed.message
+    state = message.guild and OMEGA.guild_states.get(message.guild.id)
+    if state is None or message.channel.id not in state.radio_channels:
+        return
+    if message.author == OMEGA.user or not message.attachments:
+        return
+    try:
+        await message.delete()
+    except discord.HTTPException as error:
+        logging.warning("Could not delete radio mode attachment in %s: %s",
+                        message.channel, error)
+        return
+    OMEGA.dispatcher.submit(
+        message.author,
+        f"{message.channel.mention} is in radio mode, so only text is "
+        "allowed and your message with an attachment was removed."
+        + (f"\n> {message.content}" if message.content else ""),
+    )
+
+
+@OMEGA.command(help="Shows recently deleted and edited messages",
+               hidden=True)
+@commands.has_permissions(manage_messages=True)
+async def snipe(ctx, channel: discord.TextChannel = None, count: int = 5):
+    """Lists a channel's latest deletions and edits, newest first"""
+    if not ctx.message.guild:
+        await ctx.send(
+            "This operation does not work in private message contexts.")
+        return
+    channel = channel or ctx.channel
+    records = OMEGA.logs.latest(channel.id, max(1, min(count, OMEGA.logs_max)))
+    if not records:
+        await ctx.send(f"Nothing deleted or edited in {channel.mention} "
+                       "since I started.")
+        return
+    lines = []
+    for record in records:
+        when = datetime.datetime.utcfromtimestamp(
+            record.when).strftime("%Y-%m-%d %H:%M UTC")
+        if record.edited_content is None:
+            lines.append(f"**Deleted** {when}, <@{record.author_id}>:\n"
+                         f"{quote(record.content)}")
+        else:
+            lines.append(f"**Edited** {when}, <@{record.author_id}>:\n"
+                         f"{quote(record.content)}\nto:\n"
+                         f"{quote(record.edited_content)}")
+    for reply in pack_messages(lines):
+        await ctx.send(reply, allowed_mentions=discord.AllowedMentions.none())
+
+
+@snipe.error
+async def snipe_error(ctx, error):
+    """Error handling for snipe command"""
+    if isinstance(error, commands.errors.MissingPermissions):
+        await ctx.send("Sorry, you lack the permissions to run this command.")
+
+
+@OMEGA.pipeline.handler
+async def remember_for_snipes(processed: ProcessedMessage):
+    """Keeps new server messages' content in case they're deleted or edited"""
+    message = processed.message
+    if message.guild is None or message.author.bot:
+        return
+    OMEGA.logs.seen(message.id, message.channel.id, message.author.id,
+                    message.content)
+
+
+@OMEGA.listen("on_command_error")
+async def on_command_error(ctx, error):
+    """Suggests commands for typos and logs errors nothing else handled"""
+    if not isinstance(error, commands.CommandNotFound):
+        # Listening here turns off discord.py's default traceback printing
+        if ctx.command is None or not ctx.command.has_error_handler():
+            logging.error("Command %s failed", ctx.command, exc_info=error)
+        return
+    attempt = ctx.invoked_with
+    if not attempt:
+        return
+    if not len(OMEGA.command_index):
+        OMEGA.command_index.rebuild(OMEGA.commands)
+    matches = OMEGA.command_index.within(attempt.lower())
+    response = ("A command was attempted to be invoked "
+                f"but no command under that name ({attempt}) is found. ")
+    if not matches:
+        await ctx.send(response)
+        return
+    distance, name, command = matches[0]
+    args = ctx.view.read_rest().strip()
+    suggestion = f"{ctx.prefix}{name} {args}".strip()
+    # Only guess when one command is that close, ie not watch vs watched
+    unique = len({
+        other for other_distance, _, other in matches
+        if other_distance == distance
+    }) == 1
+    # Never guess our way into a command with permission checks, ie ban
+    if (distance == 1 and unique and AUTO_INVOKE_TYPOS and
+            not command.checks):
+        await ctx.send(f'{response}I think you meant "{suggestion}" - '
+                       "attempting to invoke that command now.")
+        ctx.view.undo()  # Back to the start of the arguments
+        ctx.command = command
+        ctx.invoked_with = name
+        await OMEGA.invoke(ctx)
+    else:
+        await ctx.send(f'{response}Did you mean "{suggestion}"?')
 
 
 # Listeners
 @OMEGA.listen("on_message")
-async def notify_on_watchword(message: discord.Message):
-    """Listens to messages
-    and notifies members when watchword conditions are met"""
+async def process_message(message: discord.Message):
+    """Hands every message to the registered pipeline handlers"""
+    await OMEGA.pipeline.dispatch(message)
+
+
+@OMEGA.pipeline.handler
+async def notify_on_watchword(processed: ProcessedMessage):
+    """Notifies members when watchword conditions are met"""
+    message = processed.message
     if message.author == OMEGA.user or message.content.startswith(
             OMEGA.command_prefix):
         return
-    content = message.content.lower().translate(
-        str.maketrans("", "", string.punctuation))
-    content_list = content.split()
+    state = message.guild and OMEGA.guild_states.get(message.guild.id)
+    if state is None:  # DMs have no watchwords
+        return
+    registry = state.watchwords
     to_be_notified = set()
-    for keyword in OMEGA.user_words:
-        if " " in keyword and keyword in content:
-            for user in OMEGA.user_words[keyword]:
-                if (discord.utils.get(message.channel.members, id=user) and
-                        message.author.id != user):
-                    to_be_notified.add(user)
-                    logging.info(
-                        "Sending %s to %s for watchword %s",
-                        message.jump_url,
-                        OMEGA.get_user(user),
-                        keyword,
-                    )
-        elif " " not in keyword and keyword in content_list:
-            for user in OMEGA.user_words[keyword]:
-                if (discord.utils.get(message.channel.members, id=user) and
-                        message.author.id != user):
-                    to_be_notified.add(user)
-                    logging.info(
-                        "Sending %s to %s for watchword %s",
-                        message.jump_url,
-                        OMEGA.get_user(user),
-                        keyword,
-                    )
+    matches = registry.match(processed.content, processed.tokens)
+    if not matches:
+        return
+    can_see = OMEGA.channel_members.member_ids(message.channel)
+    for keyword in matches:
+        recipients = can_see.intersection(registry.subscribers(keyword))
+        recipients.discard(message.author.id)
+        for user in recipients:
+            if not registry.watches_in(keyword, user, message.channel.id):
+                continue
+            if not OMEGA.watchword_throttle.allow(
+                (state.guild_id, user, keyword),
+                registry.cooldown(keyword, user)):
+                continue
+            to_be_notified.add(user)
+            logging.debug("Sending message %s to user %s for watchword %s",
+                          message.id, user, keyword)
     await notify_users(message, to_be_notified)
 
 
+@OMEGA.listen("on_member_join")
+async def index_member_join(member: discord.Member):
+    """Adds a new member to the cached channel member sets"""
+    OMEGA.channel_members.refresh_member(member)
+
+
+@OMEGA.listen("on_member_remove")
+async def index_member_remove(member: discord.Member):
+    """Removes a departed member from the cached channel member sets"""
+    OMEGA.channel_members.remove_member(member)
+
+
+@OMEGA.listen("on_member_update")
+async def index_member_update(before: discord.Member, after: discord.Member):
+    """Rechecks channel visibility when a member's roles change"""
+    if before.roles != after.roles:
+        OMEGA.channel_members.refresh_member(after)
+
+
+@OMEGA.listen("on_guild_channel_update")
+async def index_channel_update(before, after):
+    """Drops the cached member set when a channel's overwrites change"""
+    if before.overwrites != after.overwrites:
+        OMEGA.channel_members.invalidate_channel(after.id)
+
+
+@OMEGA.listen("on_guild_channel_delete")
+async def index_channel_delete(channel):
+    """Drops the cached member set of a deleted channel"""
+    OMEGA.channel_members.invalidate_channel(channel.id)
+
+
+@OMEGA.listen("on_guild_role_update")
+async def index_role_update(before: discord.Role, after: discord.Role):
+    """Drops the guild's cached member sets when a role's permissions change"""
+    if before.permissions != after.permissions:
+        OMEGA.channel_members.invalidate_guild(after.guild.id)
+
+
+@OMEGA.listen("on_guild_role_delete")
+async def index_role_delete(role: discord.Role):
+    """Drops the guild's cached member sets when a role is deleted"""
+    OMEGA.channel_members.invalidate_guild(role.guild.id)
+
+
 async def notify_users(message: discord.Message, to_be_notified):
-    """Sends the watchword notification message to users in the notify set"""
+    """Queues the watchword notification message for users in the notify set"""
     for user in to_be_notified:
-        await OMEGA.get_user(user).send(
+        OMEGA.dispatcher.submit(
+            OMEGA.get_user(user),
             "A watched word/phrase was detected! "
             f"{message.author.mention} in {message.channel.mention}\n"
             f"> {message.content}\n"
-            f"Link: {message.jump_url}")
-
-
-def sanitize_message(message: str) -> str:
-    """
-    Cleans up the message of markdown and end punctuation.
-    """
-    for outlawed in [
-            re.compile(r"([^?]+)\?"),
-            re.compile("([^!]+)!"),
-            re.compile(r"([^.]+)\."),
-    ]:
-        convicted = outlawed.match(message)
-        if convicted:
-            message = outlawed.sub(
-                convicted.group(1),
-                message)  # Removes end punctuation IIF there's other text.
-    return message
-
-
-@OMEGA.listen("on_reaction_add")
-async def berk_inflation(reaction: discord.Reaction, user: discord.User):
-    """Adjusts for berk inflation"""
-    if user == OMEGA.user:
-        return
-    try:
-        if reaction.emoji.name not in ("3berk", "omniberk"):
-            return
-    except AttributeError:
-        return
-    inflated = True
-    if reaction.emoji.name == "3berk":
-        for react in reaction.message.reactions:
-            if react.emoji.name == "berk" and react.count > 2:
-                inflated = False
-                break
-
-    if reaction.emoji.name == "omniberk":
-        for react in reaction.message.reactions:
-            if react.emoji.name == "3berk" and react.count > 2:
-                inflated = False
-                break
-    if inflated:
-        await reaction.remove(user)
-
-
-@OMEGA.listen("on_reaction_add")
-async def report_mode(reaction, user):
-    """Reports a post to the mod team"""
-    if user == OMEGA.user:
-        return
-    if reaction.emoji == "📢":
-        try:
-            await OMEGA.get_channel(int(MOD_CHAT)).send(
-                f"{reaction.message.author.mention} "
-                f"in {reaction.message.channel.mention} "
-                f"(reported by: {user.mention})\n"
-                f"> {reaction.message.content}\n"
-                f"Link: {reaction.message.jump_url}")
-            await reaction.remove(user)
-            await user.send(
-                "Thank you for your report! "
-                "It has been sent to the mod team. "
-                "You can type a response to me in this DM and react to your "
-                "own message with 📢 if you want to add additional information.")
-        except AttributeError:  # this means it's a DM
-            await OMEGA.get_channel(int(MOD_CHAT)).send(
-                f"Modmail from {reaction.message.channel}\n"
-                f"> {reaction.message.content}")
-            await reaction.message.channel.send(
-                "Mod mail was sent to the mod team. "
-                "Please wait for one of the mods to get back to you.")
+            f"Link: {message.jump_url}",
+        )
 
 
 # @OMEGA.listen("on_message")
@@ -762,80 +1266,212 @@ async def report_mode(reaction, user):
 #         break
 
 
-@OMEGA.listen("on_message")
-async def auto_slowmode(message):
-    if time.time() >= OMEGA.last_updated + OMEGA.slowmode_check_frequency:
-        delay = get_delay(OMEGA.message_cache, max(len(OMEGA.user_cache), 1))
-        channel = OMEGA.get_channel(290695292964306948)
-        if channel is not None:
-            await channel.edit(slowmode_delay=delay)
-        OMEGA.message_cache = 0
-        OMEGA.user_cache = set()
-        OMEGA.last_updated = time.time()
-    if message.channel.id != 290695292964306948:
-        return
-    OMEGA.message_cache += 1
-    OMEGA.user_cache.add(message.author)
-    logging.info(f"{OMEGA.message_cache=}, {len(OMEGA.user_cache)=}, "
-                 f"{OMEGA.message_cache / max(len(OMEGA.user_cache), 1)=}")
-
-
-def get_delay(message_count, distinct_user_count):
-    for limit in OMEGA.slowmode_time_configs:
-        if message_count / distinct_user_count >= limit:
-            return OMEGA.slowmode_time_configs[limit]
-    return 0
-
-
-# on_reaction_add doesn't work with old messages, and this is specifically going to be used on old messages a lot
-# so let's just bypass its cleverness
-@OMEGA.listen("on_raw_reaction_add")
-async def workshop_pinbot(payload):
-    """Watches for ZorbaTHut to pin-react things in #workshop, then pins them, removing a pin if necessary, because Zorba is lazy and hates removing pins manually"""
+@OMEGA.pipeline.handler
+async def auto_slowmode(processed: ProcessedMessage):
+    """Feeds slowmode-controlled channels' messages to the controller"""
+    message = processed.message
+    state = message.guild and OMEGA.guild_states.get(message.guild.id)
+    if state is None or not state.slowmode.watches(message.channel.id):
+        return
+    state.slowmode.record(message.channel.id, message.author.id)
+    await state.slowmode.update(message.channel)
+
+
+# Reaction rules
+# on_reaction_add only fires for messages in discord.py's cache, and these
+# rules are used on old messages a lot, so everything runs off raw events
+async def payload_channel(payload):
+    """Returns the channel a raw reaction happened in, DMs included"""
+    channel = OMEGA.get_channel(payload.channel_id)
+    if channel is None and payload.guild_id is None:
+        user = OMEGA.get_user(payload.user_id)
+        if user is None:
+            user = await OMEGA.fetch_user(payload.user_id)
+        channel = await user.create_dm()
+    return channel
+
+
+async def get_message(channel, message_id):
+    """Returns a message from discord.py's message cache, or else fetches it"""
+    message = channel._state._get_message(message_id)
+    if message is None:
+        message = await channel.fetch_message(message_id)
+    return message
+
+
+async def fetch_reaction_counts(channel_id, message_id):
+    """Seeds the reaction rules' counts for a message they haven't seen"""
+    channel = OMEGA.get_channel(channel_id)
+    if channel is None:
+        return {}
+    message = await channel.fetch_message(message_id)
+    return {
+        emoji_name(reaction.emoji): reaction.count
+        for reaction in message.reactions
+    }
 
-    # ZorbaTHut#4936
-    if payload.user_id != 180974399543967744:
+
+async def remove_reaction(payload):
+    """Takes back the reaction a raw payload reports"""
+    channel = OMEGA.get_channel(payload.channel_id)
+    if channel is not None:
+        await channel.get_partial_message(payload.message_id).remove_reaction(
+            payload.emoji, discord.Object(id=payload.user_id))
+
+
+OMEGA.reaction_rules = ReactionRules(fetch_reaction_counts, OMEGA.metrics)
+# Adjusts for berk inflation
+OMEGA.reaction_rules.require("3berk", "berk", 3, remove_reaction)
+OMEGA.reaction_rules.require("omniberk", "3berk", 3, remove_reaction)
+OMEGA.metrics.gauge("reaction_count_seeds", lambda: OMEGA.reaction_rules.seeds)
+
+
+@OMEGA.reaction_rules.rule("📢")
+async def report_mode(payload):
+    """Reports a post to the mod team"""
+    # DM modmail goes to the main server's mods
+    guild_id = payload.guild_id or SERVER_ID
+    mod_channel_id = await OMEGA.guild_states.mod_channel_id(guild_id)
+    if mod_channel_id is None:
+        logging.warning("Guild %s has no mod chat configured", guild_id)
+        return
+    mod_channel = OMEGA.get_channel(mod_channel_id)
+    if mod_channel is None:  # On another shard process
+        mod_channel = await OMEGA.fetch_channel(mod_channel_id)
+    # Repeat reports only need the message ID, so they make no REST calls
+    # beyond hiding the reaction
+    reported = (OMEGA.reports.report_again(mod_channel, payload.message_id,
+                                           payload.user_id)
+                if payload.guild_id is not None else None)
+    if reported is None:
+        channel = await payload_channel(payload)
+        if channel is None:
+            return
+        message = await get_message(channel, payload.message_id)
+    if payload.guild_id is None:  # this means it's a DM
+        opened = OMEGA.reports.modmail(mod_channel, message)
+        if opened:
+            OMEGA.dispatcher.submit(
+                channel,
+                "Mod mail was sent to the mod team. "
+                "Please wait for one of the mods to get back to you. "
+                "Anything else you react to with 📢 will be added to it.",
+                coalesce=False,
+            )
+        elif opened is not None:
+            await message.add_reaction("✅")
+        return
+    if reported is None:
+        reported = OMEGA.reports.report(mod_channel, message, payload.user_id)
+    await remove_reaction(payload)
+    if reported:
+        OMEGA.dispatcher.submit(
+            payload.member,
+            "Thank you for your report! "
+            "It has been sent to the mod team. "
+            "You can type a response to me in this DM and react to your "
+            "own message with 📢 if you want to add additional information.",
+            coalesce=False,
+        )
+
+
+@OMEGA.reaction_rules.rule("📌",
+                           channels=PINBOT_CHANNEL_IDS,
+                           users=PINBOT_USER_IDS)
+async def workshop_pinbot(payload):
+    """Watches for the pinbot users (ie ZorbaTHut in #workshop) to pin-react things in the pinbot channels, then pins them, removing a pin if necessary, because Zorba is lazy and hates removing pins manually"""
+    channel = OMEGA.get_channel(payload.channel_id)
+    if channel is None:
         return
 
-    # #workshop
-    if payload.channel_id != 832840713758441494:
+    pins = await OMEGA.pin_cache.pins(channel)
+    if payload.message_id in pins:
         return
+    if len(pins) >= PIN_LIMIT:
+        # too many pins, gonna have to remove the oldest one
+        # but don't remove the sticky posts!
+        removable = [pin for pin in pins if pin not in PINBOT_STICKY_IDS]
+        if removable:
+            await OMEGA.pin_cache.unpin(channel, removable[-1])
+
+    # Actually pin the thing we've been told to pin
+    await OMEGA.pin_cache.pin(channel, payload.message_id)
 
-    # a pushpin, obviously
-    if payload.emoji.name != "📌":
+
+@OMEGA.reaction_rules.rule()
+async def radio_mode_reaction(payload):
+    """Clears reactions in radio channels, which are text-only"""
+    state = OMEGA.guild_states.get(payload.guild_id)
+    if state is None or payload.channel_id not in state.radio_channels:
+        return
+    channel = OMEGA.get_channel(payload.channel_id)
+    if channel is None:
         return
+    try:
+        await channel.get_partial_message(payload.message_id).clear_reaction(
+            payload.emoji)
+    except discord.HTTPException as error:
+        logging.warning("Could not clear radio mode reaction in %s: %s",
+                        channel, error)
 
-    # Get the channel object, which isn't provided for us with on_raw_reaction_add
-    channel = await OMEGA.fetch_channel(payload.channel_id)
 
-    # Get the list of pins
-    pins = await channel.pins()
-    if len(pins) == 50:
-        # too many pins, gonna have to remove one
-        # but don't remove the sticky post that Zorba made at the beginning!
-        if len(pins) > 0 and pins[-1].id == 832841374809849877:
-            pins.pop()
+@OMEGA.listen("on_raw_reaction_add")
+async def apply_reaction_rules(payload):
+    """Counts the reaction and runs every rule that applies to it"""
+    await OMEGA.reaction_rules.reaction_added(payload)
 
-        # found a pin to remove, do it
-        if len(pins) > 0:
-            await pins[-1].unpin()
 
-    # Actually pin the thing we've been told to pin
-    message = await channel.fetch_message(payload.message_id)
-    await message.pin()
+@OMEGA.listen("on_raw_reaction_remove")
+async def track_reaction_remove(payload):
+    """Keeps the reaction rules' counts current"""
+    OMEGA.reaction_rules.reaction_removed(payload)
 
 
-# @OMEGA.listen("on_reaction_add")
-# async def radio_mode_reaction(reaction, user):
-#     """Listens to reactions and clears them if they're in a radio channel"""
-#     if user == OMEGA.user:
-#         return
-#     cur.execute(
-#         "SELECT COUNT(1) FROM radio WHERE channel_id=?;",
-#         (reaction.message.channel.id,)
-#     )
-#     if cur.fetchall()[0][0]:
-#         await reaction.clear()
+@OMEGA.listen("on_raw_reaction_clear")
+async def track_reaction_clear(payload):
+    """Keeps the reaction rules' counts current"""
+    OMEGA.reaction_rules.cleared(payload.message_id)
+
+
+@OMEGA.listen("on_raw_reaction_clear_emoji")
+async def track_reaction_clear_emoji(payload):
+    """Keeps the reaction rules' counts current"""
+    OMEGA.reaction_rules.cleared(payload.message_id, payload.emoji)
+
+
+@OMEGA.listen("on_guild_channel_pins_update")
+async def track_pins_update(channel, last_pin):
+    """Keeps the pin cache in sync with pins made outside the bot"""
+    OMEGA.pin_cache.pins_updated(channel.id)
+
+
+@OMEGA.listen("on_raw_message_delete")
+async def track_message_delete(payload):
+    """Drops deleted messages from the caches and logs them for snipe"""
+    OMEGA.pin_cache.messages_deleted(payload.channel_id, {payload.message_id})
+    OMEGA.reaction_rules.forget((payload.message_id,))
+    if payload.guild_id is not None:
+        OMEGA.logs.deleted(payload.message_id, payload.cached_message)
+
+
+@OMEGA.listen("on_raw_bulk_message_delete")
+async def track_bulk_message_delete(payload):
+    """Drops bulk-deleted messages from the caches and logs them for snipe"""
+    OMEGA.pin_cache.messages_deleted(payload.channel_id, payload.message_ids)
+    OMEGA.reaction_rules.forget(payload.message_ids)
+    cached = {message.id: message for message in payload.cached_messages}
+    for message_id in sorted(payload.message_ids):
+        OMEGA.logs.deleted(message_id, cached.get(message_id))
+
+
+@OMEGA.listen("on_raw_message_edit")
+async def track_message_edit(payload):
+    """Logs content edits for snipe"""
+    content = payload.data.get("content")
+    if content is None or "guild_id" not in payload.data:
+        return  # Embed or pin updates, or a DM
+    OMEGA.logs.edited(payload.message_id, content, payload.cached_message)
+
 
 # Flipping the switch
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+"""Cached channel membership for filtering watchword recipients"""
+import asyncio
+import logging
+
+QUERY_BATCH = 100  # Most user IDs Discord takes in one member request
+
+
+class ChannelMemberIndex:
+    """
+    Keeps the set of member IDs that can see each channel, built from
+    channel.members the first time a channel is asked about.
+    In the lean gateway mode channel.members only holds the members fetched
+    through cache_members, which is enough as long as every watchword
+    subscriber is.
+    Joins, leaves and role changes update the cached sets for that one member;
+    permission overwrite and role permission changes drop the affected sets
+    so they get rebuilt on next use.
+    """
+
+    def __init__(self):
+        self._member_ids = {}  # channel id -> set of member ids
+        self._guild_channels = {}  # guild id -> {channel id: channel}
+        self.hits = 0
+        self.rebuilds = 0
+        self.fetched = 0
+
+    def member_ids(self, channel) -> set:
+        """Returns the IDs of members who can read channel"""
+        member_ids = self._member_ids.get(channel.id)
+        if member_ids is not None:
+            self.hits += 1
+            return member_ids
+        guild = getattr(channel, "guild", None)
+        if guild is None:  # DMs have no member list to filter on
+            return set()
+        self.rebuilds += 1
+        member_ids = {member.id for member in channel.members}
+        self._member_ids[channel.id] = member_ids
+        self._guild_channels.setdefault(guild.id, {})[channel.id] = channel
+        return member_ids
+
+    async def cache_members(self, guild, user_ids):
+        """
+        Fetches the given users' members into discord.py's cache if they
+        aren't there yet, and adds them to the cached channel sets.
+        A no-op when every member was cached at startup.
+        """
+        missing = [
+            user_id for user_id in dict.fromkeys(user_ids)
+            if guild.get_member(user_id) is None
+        ]
+        for start in range(0, len(missing), QUERY_BATCH):
+            batch = missing[start:start + QUERY_BATCH]
+            try:
+                members = await guild.query_members(user_ids=batch,
+                                                    limit=len(batch),
+                                                    cache=True)
+            except asyncio.TimeoutError:
+                logging.warning("Timed out fetching %s members of %s",
+                                len(batch), guild)
+                continue
+            self.fetched += len(members)
+            for member in members:
+                self.refresh_member(member)
+
+    def refresh_member(self, member):
+        """Rechecks one member against every cached channel in their guild"""
+        for channel_id, channel in self._guild_channels.get(
+                member.guild.id, {}).items():
+            if channel.permissions_for(member).read_messages:
+                self._member_ids[channel_id].add(member.id)
+            else:
+                self._member_ids[channel_id].discard(member.id)
+
+    def remove_member(self, member):
+        """Drops a member who left the guild from every cached channel"""
+        for channel_id in self._guild_channels.get(member.guild.id, {}):
+            self._member_ids[channel_id].discard(member.id)
+
+    def invalidate_channel(self, channel_id: int):
+        """Forgets one channel, ie after its permission overwrites changed"""
+        self._member_ids.pop(channel_id, None)
+        for channels in self._guild_channels.values():
+            channels.pop(channel_id, None)
+
+    def invalidate_guild(self, guild_id: int):
+        """Forgets every channel in a guild, ie after a role's permissions changed"""
+        for channel_id in self._guild_channels.pop(guild_id, {}):
+            self._member_ids.pop(channel_id, None)
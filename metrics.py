@@ -0,0 +1,170 @@
+"""Counters, gauges and latency histograms for the stats command"""
+import asyncio
+import bisect
+import logging
+import math
+import time
+
+from aiohttp import web
+
+# Upper bounds in seconds, roughly logarithmic from 1ms to 10s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram, cheap enough for every message"""
+
+    __slots__ = ("counts", "count", "total", "worst")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # Last one is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.worst:
+            self.worst = seconds
+
+    def quantile(self, fraction: float) -> float:
+        """Returns the upper bound of the bucket holding the quantile"""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.worst
+
+
+def _labels_text(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """
+    Named counters and histograms, each keyed by an optional set of labels,
+    plus gauges read from other objects' own counters when reported.
+    Recording is a dict lookup and an add, so it's fine on hot paths.
+    """
+
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> int
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}  # name -> function returning a number
+        self.started = time.time()
+        self._monitor = None
+        self._server = None
+
+    def increment(self, name: str, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def gauge(self, name: str, read):
+        """Registers read(), called whenever metrics are reported"""
+        self.gauges[name] = read
+
+    def _gauge_values(self):
+        for name, read in sorted(self.gauges.items()):
+            try:
+                yield name, read()
+            except Exception:
+                logging.exception("Could not read gauge %s", name)
+
+    def report(self) -> str:
+        """Returns a human-readable summary, one metric per line"""
+        lines = [f"Uptime: {time.time() - self.started:.0f}s"]
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            average = histogram.total / histogram.count * 1000
+            lines.append(
+                f"{name}{_labels_text(labels)}: {histogram.count} calls, "
+                f"{average:.2f}ms average, "
+                f"p99 <= {histogram.quantile(0.99) * 1000:g}ms, "
+                f"{histogram.worst * 1000:.2f}ms max")
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{_labels_text(labels)}: {value}")
+        for name, value in self._gauge_values():
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE omega_{name} {kind}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, math.inf),
+                                    histogram.counts):
+                cumulative += count
+                bucket = labels + (("le", "+Inf" if bound == math.inf else
+                                    f"{bound:g}"),)
+                lines.append(f"omega_{name}_bucket{_labels_text(bucket)} "
+                             f"{cumulative}")
+            lines.append(f"omega_{name}_sum{_labels_text(labels)} "
+                         f"{histogram.total}")
+            lines.append(f"omega_{name}_count{_labels_text(labels)} "
+                         f"{histogram.count}")
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(name, "counter")
+            lines.append(f"omega_{name}{_labels_text(labels)} {value}")
+        for name, value in self._gauge_values():
+            declare(name, "gauge")
+            lines.append(f"omega_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def start(self, lag_interval=1.0):
+        """Starts sampling event loop lag every lag_interval seconds"""
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.ensure_future(
+                self._monitor_loop(lag_interval))
+
+    async def _monitor_loop(self, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.observe("event_loop_lag_seconds",
+                         max(loop.time() - expected, 0.0))
+
+    async def serve(self, host: str, port: int):
+        """Serves prometheus() at http://host:port/metrics"""
+        if self._server is not None:
+            return
+
+        async def handle(_):
+            return web.Response(text=self.prometheus())
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        self._server = runner
+        logging.info("Serving metrics on http://%s:%s/metrics", host, port)
+
+    async def close(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+        if self._server is not None:
+            await self._server.cleanup()
+            self._server = None
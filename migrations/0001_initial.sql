@@ -20,4 +20,12 @@ CREATE TABLE IF NOT EXISTS watchword (
     channels TEXT,
     FOREIGN KEY(user_id) REFERENCES user(user_id),
     UNIQUE (guild_id, user_id, word) ON CONFLICT REPLACE
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS search_cache (
+    pseid TEXT NOT NULL,
+    query TEXT NOT NULL,
+    result TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (pseid, query)
+) WITHOUT ROWID;
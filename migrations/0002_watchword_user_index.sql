@@ -0,0 +1,5 @@
+-- The UNIQUE constraint leads with guild_id, so looking up one user's
+-- watchwords was a full table scan. Covers the keyset-paginated `watched`.
+
+CREATE INDEX IF NOT EXISTS watchword_user
+    ON watchword (user_id, guild_id, word);
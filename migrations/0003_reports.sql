@@ -0,0 +1,20 @@
+-- One row per reported message, so repeat reports update one mod-chat post,
+-- and one running modmail ticket per user.
+
+CREATE TABLE IF NOT EXISTS report (
+    message_id INTEGER NOT NULL PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    jump_url TEXT NOT NULL,
+    reporters TEXT NOT NULL,
+    mod_message_id INTEGER,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS modmail_ticket (
+    user_id INTEGER NOT NULL PRIMARY KEY,
+    entries TEXT NOT NULL,
+    mod_message_id INTEGER,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
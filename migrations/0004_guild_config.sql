@@ -0,0 +1,17 @@
+-- Per-guild configuration, so one bot can serve several communities.
+-- Channels take part in auto slowmode by flag, like radio mode.
+
+CREATE TABLE IF NOT EXISTS guild (
+    guild_id INTEGER NOT NULL PRIMARY KEY ASC,
+    mod_channel_id INTEGER,
+    playground_channel_id INTEGER,
+    silliness_channel_id INTEGER,
+    -- What the cw command tells a muted member, and the role that mutes them
+    cw_rules_url TEXT,
+    cw_contact TEXT,
+    cw_role_name TEXT
+) WITHOUT ROWID;
+
+ALTER TABLE channel ADD COLUMN slowmode BOOLEAN NOT NULL default false;
+
+CREATE INDEX IF NOT EXISTS channel_guild ON channel (guild_id);
@@ -0,0 +1,129 @@
+"""Background delivery of watchword DMs and mod-chat posts"""
+import asyncio
+import logging
+
+import discord
+
+MESSAGE_LIMIT = 2000
+
+
+def pack_messages(parts, limit=MESSAGE_LIMIT, separator="\n\n"):
+    """Joins parts into as few messages of at most limit characters as possible"""
+    messages = []
+    current = ""
+    for part in parts:
+        part = part[:limit]
+        if current and len(current) + len(separator) + len(part) <= limit:
+            current += separator + part
+        else:
+            if current:
+                messages.append(current)
+            current = part
+    if current:
+        messages.append(current)
+    return messages
+
+
+class MessageDispatcher:
+    """
+    Sends messages from a queue with a fixed pool of worker tasks,
+    so listeners never wait on Discord round-trips.
+    Messages for the same destination that arrive within coalesce_window
+    seconds of each other go out as a single message. Rate limiting per route
+    is left to discord.py's bucket locks; a 429 or 5xx that still gets
+    through is retried with backoff, and one recipient failing never
+    affects the others.
+    """
+
+    def __init__(self, concurrency=5, coalesce_window=2.0, max_retries=3):
+        self.concurrency = concurrency
+        self.coalesce_window = coalesce_window
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self._batches = {}  # destination id -> parts still accepting more
+        self._queue = None
+        self._workers = []
+
+    def start(self):
+        """Spawns the worker tasks on the running event loop"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.ensure_future(self._work())
+            for _ in range(self.concurrency)
+        ]
+
+    async def close(self):
+        """Stops the workers, dropping whatever is still queued"""
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if self._batches or (self._queue is not None and
+                             not self._queue.empty()):
+            logging.info("Dropped %s queued messages on shutdown",
+                         len(self._batches) + self._queue.qsize())
+        self._batches = {}
+        self._queue = None
+
+    def submit(self, destination, content: str, coalesce=True):
+        """
+        Queues content for destination (a User, Member or channel).
+        With coalesce, it gets merged with anything else sent to the same
+        destination before the batch is picked up.
+        """
+        if destination is None:
+            logging.info("Dropping message for unknown destination: %s",
+                         content[:100])
+            return
+        self.start()
+        if not coalesce:
+            self._queue.put_nowait((destination, [content]))
+            return
+        parts = self._batches.get(destination.id)
+        if parts is not None:
+            parts.append(content)
+            self.coalesced += 1
+            return
+        parts = self._batches[destination.id] = [content]
+        asyncio.get_running_loop().call_later(self.coalesce_window,
+                                              self._queue.put_nowait,
+                                              (destination, parts))
+
+    async def _work(self):
+        while True:
+            destination, parts = await self._queue.get()
+            if self._batches.get(destination.id) is parts:
+                del self._batches[destination.id]
+            try:
+                for content in pack_messages(parts):
+                    await self._deliver(destination, content)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, destination, content):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await destination.send(content)
+                self.sent += 1
+                return
+            except discord.Forbidden:
+                logging.info(
+                    "Could not message %s, they have DMs closed or the bot "
+                    "blocked", destination)
+                break
+            except discord.HTTPException as error:
+                if attempt == self.max_retries or (error.status != 429 and
+                                                   error.status < 500):
+                    logging.warning("Could not message %s: %s", destination,
+                                    error)
+                    break
+                await asyncio.sleep(2**attempt)
+            except Exception:
+                logging.exception("Unexpected error messaging %s",
+                                  destination)
+                break
+        self.failed += 1
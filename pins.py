@@ -0,0 +1,76 @@
+"""In-memory pin lists for the pinbot"""
+import collections
+import time
+
+PIN_LIMIT = 50
+EXPECT_TTL = 10  # Seconds to wait for the pins update our own call causes
+
+
+class PinCache:
+    """
+    Each channel's pinned message IDs, newest pin first.
+    A channel's list is fetched once and then kept current from our own
+    pin/unpin calls and from deletes. A pins update we didn't cause (someone
+    pinning by hand) drops the list so it's fetched again on next use.
+    Updates we expect are only remembered for EXPECT_TTL seconds, so one
+    that never arrives can't hide a later manual pin for long.
+    """
+
+    def __init__(self):
+        self.seeds = 0
+        self._pins = {}  # channel id -> list of message ids
+        # channel id -> expiry times of the updates our own calls will cause
+        self._expected = collections.defaultdict(collections.deque)
+
+    async def pins(self, channel) -> list:
+        """Returns the channel's pinned message IDs, newest first"""
+        pins = self._pins.get(channel.id)
+        if pins is None:
+            pins = [message.id for message in await channel.pins()]
+            self._pins[channel.id] = pins
+            self.seeds += 1
+        return pins
+
+    async def _change(self, channel, message_id, pin):
+        message = channel.get_partial_message(message_id)
+        await (message.pin() if pin else message.unpin())
+        pins = self._pins.get(channel.id)
+        if pins is not None and (message_id in pins) == pin:
+            return  # Already the case, so Discord sends no update
+        self._expected[channel.id].append(time.monotonic() + EXPECT_TTL)
+        if pins is None:
+            return
+        if message_id in pins:
+            pins.remove(message_id)
+        if pin:
+            pins.insert(0, message_id)
+
+    async def pin(self, channel, message_id: int):
+        """Pins a message by ID without fetching it"""
+        await self._change(channel, message_id, True)
+
+    async def unpin(self, channel, message_id: int):
+        """Unpins a message by ID without fetching it"""
+        await self._change(channel, message_id, False)
+
+    def pins_updated(self, channel_id: int):
+        """Handles on_guild_channel_pins_update"""
+        expected = self._expected.get(channel_id)
+        now = time.monotonic()
+        while expected and expected[0] <= now:
+            expected.popleft()
+        if expected:
+            expected.popleft()
+        else:
+            self._pins.pop(channel_id, None)
+        if not expected:
+            self._expected.pop(channel_id, None)
+
+    def messages_deleted(self, channel_id: int, message_ids):
+        """Forgets deleted messages, which Discord unpins silently"""
+        pins = self._pins.get(channel_id)
+        if pins:
+            self._pins[channel_id] = [
+                message_id for message_id in pins
+                if message_id not in message_ids
+            ]
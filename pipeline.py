@@ -0,0 +1,73 @@
+"""Single on_message dispatch stage shared by every message handler"""
+import logging
+import string
+import time
+
+from metrics import Metrics
+
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+
+def normalize(text: str) -> str:
+    """Lowercases text and strips punctuation, as watchwords are stored"""
+    return text.lower().translate(PUNCTUATION_TABLE)
+
+
+class ProcessedMessage:
+    """
+    A message plus its normalized content and tokens, computed at most once
+    and only if some handler asks for them.
+    """
+
+    __slots__ = ("message", "_content", "_tokens")
+
+    def __init__(self, message):
+        self.message = message
+        self._content = None
+        self._tokens = None
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            self._content = normalize(self.message.content)
+        return self._content
+
+    @property
+    def tokens(self) -> list:
+        if self._tokens is None:
+            self._tokens = self.content.split()
+        return self._tokens
+
+
+class MessagePipeline:
+    """
+    Runs every registered handler on each message in registration order,
+    sharing one ProcessedMessage between them.
+    One handler raising doesn't stop the rest, and each handler's latency
+    and errors are recorded as message_handler_seconds and
+    message_handler_errors_total.
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.handlers = []
+        self.metrics = metrics
+
+    def handler(self, func):
+        """Decorator registering a coroutine that takes a ProcessedMessage"""
+        self.handlers.append(func)
+        return func
+
+    async def dispatch(self, message):
+        processed = ProcessedMessage(message)
+        for handler in self.handlers:
+            started = time.perf_counter()
+            try:
+                await handler(processed)
+            except Exception:
+                self.metrics.increment("message_handler_errors_total",
+                                       handler=handler.__name__)
+                logging.exception("Message handler %s failed",
+                                  handler.__name__)
+            self.metrics.observe("message_handler_seconds",
+                                 time.perf_counter() - started,
+                                 handler=handler.__name__)
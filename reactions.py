@@ -0,0 +1,144 @@
+"""Reaction rules driven by raw gateway events"""
+import collections
+import logging
+import time
+
+
+def emoji_name(emoji) -> str:
+    """Returns a custom emoji's name, or a unicode emoji itself"""
+    return getattr(emoji, "name", emoji)
+
+
+class ReactionRule:
+    """One handler, run when its emoji is added where its filters allow"""
+
+    __slots__ = ("name", "handler", "emoji", "channels", "users")
+
+    def __init__(self, handler, emoji=None, channels=None, users=None):
+        self.name = handler.__name__
+        self.handler = handler
+        self.emoji = emoji  # None matches every emoji
+        self.channels = channels  # Container of channel IDs, None for all
+        self.users = users  # Container of user IDs, None for all
+
+    def applies(self, payload) -> bool:
+        return ((self.channels is None or payload.channel_id in self.channels)
+                and (self.users is None or payload.user_id in self.users))
+
+
+class ReactionRules:
+    """
+    Runs declarative reaction rules from on_raw_reaction_add, so they work
+    on messages of any age and not just those in discord.py's cache.
+    Per-message reaction counts live in an LRU of capacity messages and
+    are kept current from raw add/remove/clear payloads. A message's
+    counts are fetched once, the first time a rule asks about it, after
+    which count() is a dict lookup.
+    fetch_counts(channel_id, message_id) must return {emoji name: count}.
+    """
+
+    def __init__(self, fetch_counts, metrics=None, capacity=10000):
+        self.fetch_counts = fetch_counts
+        self.metrics = metrics
+        self.capacity = capacity
+        self.self_id = None  # The bot's own reactions count but run no rules
+        self.seeds = 0
+        self._by_emoji = collections.defaultdict(list)
+        self._any_emoji = []
+        self._counts = collections.OrderedDict()  # message id -> {name: n}
+
+    def rule(self, emoji=None, channels=None, users=None):
+        """
+        Decorator registering a coroutine taking the raw payload, run when
+        emoji (any emoji if None) is added in one of channels by one of
+        users. Both filters may be live sets that change later.
+        """
+
+        def register(handler):
+            rule = ReactionRule(handler, emoji, channels, users)
+            if emoji is None:
+                self._any_emoji.append(rule)
+            else:
+                self._by_emoji[emoji].append(rule)
+            return handler
+
+        return register
+
+    def require(self, emoji: str, other: str, minimum: int, remove):
+        """
+        Declares that emoji may only be added to messages that already
+        have at least minimum of other; remove(payload) undoes the rest.
+        """
+
+        async def requirement(payload):
+            if await self.count(payload, other) < minimum:
+                await remove(payload)
+
+        requirement.__name__ = f"require_{minimum}_{other}_for_{emoji}"
+        self.rule(emoji)(requirement)
+
+    async def count(self, payload, emoji: str) -> int:
+        """Returns how many emoji reactions the payload's message has"""
+        counts = self._counts.get(payload.message_id)
+        if counts is None:
+            counts = await self.fetch_counts(payload.channel_id,
+                                             payload.message_id)
+            self._remember(payload.message_id, counts)
+            self.seeds += 1
+        else:
+            self._counts.move_to_end(payload.message_id)
+        return counts.get(emoji, 0)
+
+    def _remember(self, message_id, counts):
+        self._counts[message_id] = counts
+        self._counts.move_to_end(message_id)
+        while len(self._counts) > self.capacity:
+            self._counts.popitem(last=False)
+
+    def _adjust(self, payload, change):
+        counts = self._counts.get(payload.message_id)
+        if counts is None:
+            return  # Untracked, it gets fetched whole if a rule needs it
+        name = emoji_name(payload.emoji)
+        counts[name] = max(counts.get(name, 0) + change, 0)
+
+    async def reaction_added(self, payload):
+        """Handles on_raw_reaction_add"""
+        self._adjust(payload, 1)
+        if payload.user_id == self.self_id:
+            return
+        for rule in (*self._by_emoji.get(emoji_name(payload.emoji), ()),
+                     *self._any_emoji):
+            if not rule.applies(payload):
+                continue
+            started = time.perf_counter()
+            try:
+                await rule.handler(payload)
+            except Exception:
+                logging.exception("Reaction rule %s failed", rule.name)
+                if self.metrics is not None:
+                    self.metrics.increment("reaction_rule_errors_total",
+                                           rule=rule.name)
+            if self.metrics is not None:
+                self.metrics.observe("reaction_rule_seconds",
+                                     time.perf_counter() - started,
+                                     rule=rule.name)
+
+    def reaction_removed(self, payload):
+        """Handles on_raw_reaction_remove"""
+        self._adjust(payload, -1)
+
+    def cleared(self, message_id: int, emoji=None):
+        """Handles reaction clears, of one emoji or all of them"""
+        counts = self._counts.get(message_id)
+        if counts is None:
+            return
+        if emoji is None:
+            counts.clear()
+        else:
+            counts.pop(emoji_name(emoji), None)
+
+    def forget(self, message_ids):
+        """Drops the counts of deleted messages"""
+        for message_id in message_ids:
+            self._counts.pop(message_id, None)
@@ -0,0 +1,248 @@
+"""Deduplicated mod-chat reports and running modmail tickets"""
+import asyncio
+import logging
+import time
+
+import discord
+import ujson
+
+from notifier import MESSAGE_LIMIT
+
+REPORT_RETENTION = 7 * 86400  # Older reports of a message get a fresh post
+TICKET_IDLE = 86400  # A DM after this long without one opens a new ticket
+MAX_REPORTERS_SHOWN = 20
+
+
+def quote(text: str) -> str:
+    """Formats text as a Discord block quote, every line of it"""
+    return "\n".join(f"> {line}" for line in text.splitlines()) or ">"
+
+
+class Report:
+    """Every report of one message, shown as a single mod-chat post"""
+
+    __slots__ = ("message_id", "channel_id", "author_id", "content",
+                 "jump_url", "reporters", "mod_message_id", "updated",
+                 "version")
+
+    SAVE = ("INSERT OR REPLACE INTO report (message_id, channel_id, "
+            "author_id, content, jump_url, reporters, mod_message_id, "
+            "updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?);")
+
+    def __init__(self, message_id, channel_id, author_id, content, jump_url,
+                 reporters, mod_message_id, updated):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.content = content
+        self.jump_url = jump_url
+        self.reporters = reporters  # User IDs, in the order they reported
+        self.mod_message_id = mod_message_id
+        self.updated = updated
+        self.version = 0
+
+    def row(self):
+        return (self.message_id, self.channel_id, self.author_id,
+                self.content, self.jump_url, ujson.dumps(self.reporters),
+                self.mod_message_id, self.updated)
+
+    def render(self) -> str:
+        shown = ", ".join(f"<@{reporter}>"
+                          for reporter in self.reporters[:MAX_REPORTERS_SHOWN])
+        if len(self.reporters) > MAX_REPORTERS_SHOWN:
+            shown += f" and {len(self.reporters) - MAX_REPORTERS_SHOWN} more"
+        count = (f"**{len(self.reporters)} reports:** "
+                 if len(self.reporters) > 1 else "")
+        header = (f"{count}<@{self.author_id}> in <#{self.channel_id}> "
+                  f"(reported by: {shown})\n")
+        footer = f"\nLink: {self.jump_url}"
+        room = MESSAGE_LIMIT - len(header) - len(footer)
+        return header + quote(self.content)[:room] + footer
+
+
+class Ticket:
+    """One user's modmail messages, shown as a single running mod-chat post"""
+
+    __slots__ = ("user_id", "entries", "mod_message_id", "updated", "version")
+
+    SAVE = ("INSERT OR REPLACE INTO modmail_ticket (user_id, entries, "
+            "mod_message_id, updated) VALUES (?, ?, ?, ?);")
+
+    def __init__(self, user_id, entries, mod_message_id, updated):
+        self.user_id = user_id
+        self.entries = entries  # [message id, content] pairs
+        self.mod_message_id = mod_message_id
+        self.updated = updated
+        self.version = 0
+
+    def row(self):
+        return (self.user_id, ujson.dumps(self.entries), self.mod_message_id,
+                self.updated)
+
+    def render(self, entries=None) -> str:
+        entries = self.entries if entries is None else entries
+        count = f" ({len(entries)} messages)" if len(entries) > 1 else ""
+        return (f"Modmail from <@{self.user_id}>{count}\n" +
+                "\n".join(quote(content) for _, content in entries))
+
+
+class ReportQueue:
+    """
+    Turns 📢 reports into one mod-chat post per reported message, and DMs
+    flagged for modmail into one running post per user.
+    The first report or DM posts right away; later ones only edit that
+    post, at most once per edit_delay seconds however many arrive, and
+    repeat reports from the same user are ignored.
+    Reports and tickets are kept in the report and modmail_ticket tables,
+    so a restart keeps editing the same posts.
+    """
+
+    def __init__(self, storage, writes, edit_delay=5.0):
+        self.storage = storage
+        self.writes = writes
+        self.edit_delay = edit_delay
+        self.reports = 0
+        self.duplicates = 0
+        self.posts = 0
+        self.edits = 0
+        self._reports = {}  # reported message id -> Report
+        self._tickets = {}  # user id -> Ticket
+        self._flushing = {}  # Report or Ticket -> task posting its changes
+        self._loaded = False
+
+    async def load(self):
+        """
+        Loads recent reports and open tickets, dropping the rest. Only the
+        first call does anything, since on_ready runs again on reconnects
+        and the loaded reports may have edits pending by then.
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+        now = time.time()
+        await self.storage.execute("DELETE FROM report WHERE updated <= ?;",
+                                   (now - REPORT_RETENTION,))
+        await self.storage.execute(
+            "DELETE FROM modmail_ticket WHERE updated <= ?;",
+            (now - TICKET_IDLE,))
+        for (message_id, channel_id, author_id, content, jump_url, reporters,
+             mod_message_id, updated) in await self.storage.fetchall(
+                 "SELECT message_id, channel_id, author_id, content, "
+                 "jump_url, reporters, mod_message_id, updated FROM report;"):
+            self._reports[message_id] = Report(message_id, channel_id,
+                                               author_id, content, jump_url,
+                                               ujson.loads(reporters),
+                                               mod_message_id, updated)
+        for user_id, entries, mod_message_id, updated in (
+                await self.storage.fetchall(
+                    "SELECT user_id, entries, mod_message_id, updated "
+                    "FROM modmail_ticket;")):
+            self._tickets[user_id] = Ticket(user_id, ujson.loads(entries),
+                                            mod_message_id, updated)
+
+    def _forget_old_reports(self, now):
+        cutoff = now - REPORT_RETENTION
+        for message_id in [
+                message_id for message_id, report in self._reports.items()
+                if report.updated <= cutoff and report not in self._flushing
+        ]:
+            del self._reports[message_id]
+
+    def report_again(self, mod_channel, message_id: int, reporter_id: int):
+        """
+        Records a report of a message that already has a recent report,
+        without needing the message itself. Returns None if it has none,
+        in which case the caller fetches it for report(), otherwise the same
+        as report().
+        """
+        now = time.time()
+        self._forget_old_reports(now)
+        report = self._reports.get(message_id)
+        if report is None:
+            return None
+        return self._add_reporter(mod_channel, report, reporter_id, now)
+
+    def report(self, mod_channel, message, reporter_id: int) -> bool:
+        """
+        Records a report of message, returning False if reporter_id had
+        already reported it.
+        """
+        now = time.time()
+        self._forget_old_reports(now)
+        report = self._reports.get(message.id)
+        if report is None:
+            report = self._reports[message.id] = Report(
+                message.id, message.channel.id, message.author.id,
+                message.content, message.jump_url, [], None, now)
+        return self._add_reporter(mod_channel, report, reporter_id, now)
+
+    def _add_reporter(self, mod_channel, report, reporter_id, now):
+        if reporter_id in report.reporters:
+            self.duplicates += 1
+            return False
+        report.reporters.append(reporter_id)
+        self.reports += 1
+        self._publish(mod_channel, report, now)
+        return True
+
+    def modmail(self, mod_channel, message):
+        """
+        Adds a DM to its author's running ticket. Returns True if that
+        opened a new ticket, False if it joined an open one, and None if
+        the DM was already on the ticket.
+        """
+        now = time.time()
+        ticket = self._tickets.get(message.author.id)
+        if ticket is not None and any(message_id == message.id
+                                      for message_id, _ in ticket.entries):
+            self.duplicates += 1
+            return None
+        entry = [message.id, message.content]
+        opened = (ticket is None or now - ticket.updated > TICKET_IDLE or
+                  len(ticket.render(ticket.entries + [entry])) > MESSAGE_LIMIT)
+        if opened:
+            ticket = self._tickets[message.author.id] = Ticket(
+                message.author.id, [], None, now)
+        ticket.entries.append(entry)
+        self._publish(mod_channel, ticket, now)
+        return opened
+
+    def _is_current(self, item):
+        if isinstance(item, Ticket):
+            return self._tickets.get(item.user_id) is item
+        return self._reports.get(item.message_id) is item
+
+    def _publish(self, channel, item, now):
+        item.version += 1
+        item.updated = now
+        if item not in self._flushing:
+            self._flushing[item] = asyncio.ensure_future(
+                self._flush(channel, item))
+
+    async def _flush(self, channel, item):
+        try:
+            while True:
+                if item.mod_message_id is not None:
+                    await asyncio.sleep(self.edit_delay)
+                version = item.version
+                content = item.render()[:MESSAGE_LIMIT]
+                if item.mod_message_id is None:
+                    posted = await channel.send(content)
+                    item.mod_message_id = posted.id
+                    self.posts += 1
+                else:
+                    try:
+                        await channel.get_partial_message(
+                            item.mod_message_id).edit(content=content)
+                    except discord.NotFound:  # A mod deleted it, post again
+                        item.mod_message_id = None
+                        continue
+                    self.edits += 1
+                if self._is_current(item):  # Not replaced by a newer ticket
+                    await self.writes.write((item.SAVE, [item.row()]))
+                if item.version == version:
+                    break
+        except discord.HTTPException as error:
+            logging.warning("Could not post report to %s: %s", channel, error)
+        finally:
+            del self._flushing[item]
@@ -0,0 +1,135 @@
+"""Markdown and punctuation stripping for stored message text"""
+import functools
+import re
+
+CACHE_SIZE = 4096
+
+# Removes end punctuation IIF there's other text
+END_PUNCTUATION = (
+    re.compile(r"([^?]+)\?"),
+    re.compile("([^!]+)!"),
+    re.compile(r"([^.]+)\."),
+)
+
+FENCE = re.compile(r"^ {0,3}```")
+HEADER = re.compile(r"^ {0,3}#{1,6}\s+(.*?)(?:\s+#+)?\s*$")
+QUOTE = re.compile(r"^ {0,3}(?:>>>|>) ?")
+LIST_ITEM = re.compile(r"^\s*(?:[-*+]|\d+\.)\s+")
+CODE_SPAN = re.compile(r"(`+)(.+?)\1", re.DOTALL)
+ESCAPE = re.compile(r"\\([\\`*_{}\[\]()#+\-.!>~|])")
+LINK = re.compile(r"\[([^\]]*)\]\([^)\s]*\)")
+AUTOLINK = re.compile(r"<((?:https?|ftp)://[^>\s]+|mailto:[^>\s]+)>")
+STRONG = re.compile(r"(\*\*|__|~~|\|\|)(?=\S)(.+?)(?<=\S)\1", re.DOTALL)
+EMPHASIS = re.compile(
+    r"(?<![\w*])\*(?=[^\s*])(.+?)(?<=[^\s*])\*(?!\*)"
+    r"|(?<![\w_])_(?=[^\s_])(.+?)(?<=[^\s_])_(?![\w_])", re.DOTALL)
+PLACEHOLDER = re.compile("\0(\\d+)\0")
+
+
+def _strip_inline(text: str) -> str:
+    # Code spans keep their contents verbatim, so only format around them
+    pieces = []
+    position = 0
+    for match in CODE_SPAN.finditer(text):
+        pieces.append(_strip_emphasis(text[position:match.start()]))
+        pieces.append(match.group(2).strip())
+        position = match.end()
+    pieces.append(_strip_emphasis(text[position:]))
+    return "".join(pieces)
+
+
+def _strip_emphasis(text: str) -> str:
+    escaped = []
+
+    def hide(match):  # Escaped markers must survive the passes below
+        escaped.append(match.group(1))
+        return f"\0{len(escaped) - 1}\0"
+
+    text = ESCAPE.sub(hide, text)
+    text = AUTOLINK.sub(r"\1", LINK.sub(r"\1", text))
+    previous = None
+    while previous != text:  # Nested markers, ie ***both*** or **_both_**
+        previous = text
+        text = STRONG.sub(r"\2", text)
+        text = EMPHASIS.sub(lambda match: match.group(1) or match.group(2),
+                            text)
+    if escaped:
+        text = PLACEHOLDER.sub(lambda match: escaped[int(match.group(1))],
+                               text)
+    return text
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def strip_markdown(text: str) -> str:
+    """
+    Returns text without its Discord markdown: emphasis, strikethrough,
+    spoilers, code, headers, quotes, list bullets and link syntax.
+    Consecutive lines form one block as in a markdown paragraph, and blocks
+    are separated by single newlines.
+    """
+    lines = []
+    block = []
+    fenced = False
+
+    def end_block():
+        if block:
+            lines.append(_strip_inline("\n".join(block)))
+            block.clear()
+
+    for line in text.split("\n"):
+        if FENCE.match(line):
+            end_block()
+            fenced = not fenced
+            continue
+        if fenced:
+            lines.append(line)
+            continue
+        if not line.strip():
+            end_block()
+            continue
+        quote = QUOTE.match(line)
+        if quote:
+            line = line[quote.end():]
+        header = HEADER.match(line)
+        if header:
+            end_block()
+            lines.append(_strip_inline(header.group(1)))
+            continue
+        bullet = LIST_ITEM.match(line)
+        if bullet:
+            end_block()
+            line = line[bullet.end():]
+        block.append(line.strip())
+    end_block()
+    return "\n".join(lines)
+
+
+class MessageJanitor:
+    """
+    Strips the markdown out of a message.
+    Make sure not to strip out HTML-looking markup, ie <reply>: for a
+    tidbit, everything from <reply> on is kept as written.
+    """
+
+    __slots__ = ("message",)
+
+    def __init__(self, message: str):
+        self.message = message
+
+    def get_data(self) -> str:
+        head, reply, tail = self.message.partition("<reply>")
+        spacing = head[len(head.rstrip()):]  # As in "trigger <reply> ..."
+        return strip_markdown(head) + spacing + reply + tail
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def sanitize_message(message: str) -> str:
+    """
+    Cleans up the message of markdown and end punctuation.
+    """
+    for outlawed in END_PUNCTUATION:
+        convicted = outlawed.match(message)
+        if convicted:
+            kept = convicted.group(1)
+            message = outlawed.sub(lambda _: kept, message)
+    return message
@@ -0,0 +1,232 @@
+"""Caching and local lookups behind the scott/xkcd/search commands"""
+import array
+import asyncio
+import collections
+import logging
+import os
+import random
+import re
+import time
+
+from http_client import HttpError
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class SearchCache:
+    """
+    LRU cache of search results with a time-to-live, keyed on the search
+    engine ID and the normalized query.
+    Concurrent lookups of the same key share a single in-flight request.
+    If given a WriteBatcher, entries are also written to the search_cache
+    table so they survive restarts (see load).
+    """
+
+    def __init__(self, ttl=86400, max_size=1024, writes=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.writes = writes
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = collections.OrderedDict()  # key -> (expires, result)
+        self._in_flight = {}  # key -> future
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Lowercases and collapses whitespace so trivial variants share a key"""
+        return " ".join(query.lower().split())
+
+    async def load(self, storage):
+        """Drops expired rows from the search_cache table and loads the rest"""
+        now = time.time()
+        await storage.execute("DELETE FROM search_cache WHERE expires <= ?;",
+                              (now,))
+        rows = await storage.fetchall(
+            "SELECT pseid, query, result, expires FROM search_cache "
+            "ORDER BY expires DESC LIMIT ?;",
+            (self.max_size,),
+        )
+        for pseid, query, result, expires in reversed(rows):
+            self._entries[(pseid, query)] = (expires, result)
+
+    def _store(self, key, result):
+        expires = time.time() + self.ttl
+        self._entries[key] = (expires, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        if self.writes is not None:
+            task = asyncio.ensure_future(
+                self.writes.write((
+                    "INSERT OR REPLACE INTO search_cache "
+                    "(pseid, query, result, expires) VALUES (?, ?, ?, ?);",
+                    [(key[0], key[1], result, expires)],
+                )))
+            task.add_done_callback(_log_write_failure)
+
+    async def get(self, pseid: str, query: str, fetch):
+        """
+        Returns the cached result for (pseid, query), or awaits fetch()
+        to get and cache it. Exceptions from fetch are never cached.
+        """
+        key = (pseid, self.normalize(query))
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            del self._entries[key]
+            self.expirations += 1
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.shared += 1
+            return await asyncio.shield(in_flight)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()  # Waiters get cancelled too instead of hanging
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception()  # Mark as retrieved if nobody else was waiting
+            raise
+        finally:
+            del self._in_flight[key]
+        future.set_result(result)
+        self._store(key, result)
+        return result
+
+
+class LinkCorpus:
+    """
+    The links in a text file (one per line, newest first), held in memory
+    and reloaded whenever the file's mtime changes.
+    An inverted index over the words in each link's slug answers keyword
+    searches without going to the network.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.links = ()
+        self._slug_lengths = array.array("H")
+        self._index = {}  # slug word -> array of link positions
+        self._mtime = None
+
+    def __len__(self):
+        self.refresh()
+        return len(self.links)
+
+    @staticmethod
+    def slug_words(link: str):
+        """Returns the words of the last path segment of link"""
+        slug = link.rstrip("/").rsplit("/", 1)[-1]
+        return WORD_PATTERN.findall(slug.lower())
+
+    def refresh(self):
+        """Reloads the file if it changed since it was last read"""
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with open(self.path) as links_file:
+            links = tuple(line.strip() for line in links_file if line.strip())
+        index = {}
+        slug_lengths = array.array("H")
+        for position, link in enumerate(links):
+            words = self.slug_words(link)
+            slug_lengths.append(len(words))
+            for word in set(words):
+                index.setdefault(word, array.array("I")).append(position)
+        self.links = links
+        self._slug_lengths = slug_lengths
+        self._index = index
+        self._mtime = mtime
+        logging.info("Loaded %s links from %s", len(links), self.path)
+
+    def random(self) -> str:
+        """Returns a random link"""
+        self.refresh()
+        return random.choice(self.links)
+
+    def search(self, terms, limit=1):
+        """
+        Returns up to limit links whose slugs contain every word in terms,
+        best first: slugs that are mostly the search terms rank higher,
+        then newer links.
+        """
+        self.refresh()
+        words = set(WORD_PATTERN.findall(" ".join(terms).lower()))
+        if not words:
+            return []
+        postings = sorted((self._index.get(word, ()) for word in words),
+                          key=len)
+        matches = set(postings[0])
+        for posting in postings[1:]:
+            matches.intersection_update(posting)
+            if not matches:
+                return []
+        ranked = sorted(matches,
+                        key=lambda position:
+                        (self._slug_lengths[position], position))
+        return [self.links[position] for position in ranked[:limit]]
+
+
+class XkcdService:
+    """
+    Remembers the newest xkcd comic and refreshes it on a background
+    schedule, so random picks need no network call.
+    If xkcd is unreachable the last known comic keeps being used.
+    """
+
+    def __init__(self, http_client, refresh_interval=3600):
+        self.http_client = http_client
+        self.refresh_interval = refresh_interval
+        self.latest = None  # info.0.json of the newest comic
+        self._task = None
+
+    def start(self):
+        """Starts the background refresh on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._refresh_forever())
+
+    async def _refresh_forever(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self):
+        """Fetches the newest comic's metadata, keeping the old one on failure"""
+        try:
+            status, info = await self.http_client.request(
+                "GET", "https://xkcd.com/info.0.json")
+        except HttpError as error:
+            logging.warning("Could not refresh latest xkcd: %s", error)
+            return
+        if status == 200 and isinstance(info, dict) and info.get("num"):
+            self.latest = info
+        else:
+            logging.warning("Unexpected xkcd response (%s): %s", status, info)
+
+    async def random_url(self):
+        """Returns a link to a random comic, or None if none is known yet"""
+        if self.latest is None:
+            await self.refresh()
+        if self.latest is None:
+            return None
+        return f"https://xkcd.com/{random.randint(1, self.latest['num'])}"
+
+
+def _log_write_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning("Could not persist search result: %s",
+                        task.exception())
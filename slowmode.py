@@ -0,0 +1,142 @@
+"""Automatic slowmode driven by each channel's recent message rate"""
+import asyncio
+import collections
+import logging
+import time
+
+import discord
+
+
+class MessageWindow:
+    """
+    Ring buffer of (timestamp, author ID) for the messages in the last span
+    seconds, with a running count per author so the distinct-author count
+    is always at hand.
+    """
+
+    __slots__ = ("span", "events", "author_counts")
+
+    def __init__(self, span: float, max_messages: int):
+        self.span = span
+        self.events = collections.deque(maxlen=max_messages)
+        self.author_counts = {}
+
+    def _forget(self, author_id):
+        count = self.author_counts[author_id] - 1
+        if count:
+            self.author_counts[author_id] = count
+        else:
+            del self.author_counts[author_id]
+
+    def add(self, when: float, author_id: int):
+        if len(self.events) == self.events.maxlen:
+            self._forget(self.events[0][1])  # About to fall off the buffer
+        self.events.append((when, author_id))
+        self.author_counts[author_id] = self.author_counts.get(author_id, 0) + 1
+
+    def evict(self, now: float):
+        """Drops the messages older than span seconds"""
+        cutoff = now - self.span
+        while self.events and self.events[0][0] <= cutoff:
+            self._forget(self.events.popleft()[1])
+
+    def messages_per_author(self) -> float:
+        return len(self.events) / max(len(self.author_counts), 1)
+
+
+class SlowmodeController:
+    """
+    Sets slowmode on any number of channels from the messages-per-author
+    ratio over a sliding window. thresholds maps a minimum ratio to the
+    delay in seconds it calls for.
+    The ratio is rechecked on every message, so bursts get a response
+    within seconds, and on a timer so quiet channels relax again.
+    The channel is only edited when the delay actually changes, and at
+    most once per min_edit_interval seconds.
+    """
+
+    def __init__(self,
+                 channel_ids,
+                 thresholds: dict,
+                 window=600,
+                 max_messages=10000,
+                 min_edit_interval=30,
+                 check_interval=15):
+        self.thresholds = sorted(thresholds.items(), reverse=True)
+        self.window = window
+        self.max_messages = max_messages
+        self.min_edit_interval = min_edit_interval
+        self.check_interval = check_interval
+        self.edits = 0
+        self.windows = {}
+        self._last_edit = {}
+        for channel_id in channel_ids:
+            self.watch(channel_id)
+        self._task = None
+
+    def watches(self, channel_id: int) -> bool:
+        return channel_id in self.windows
+
+    def watch(self, channel_id: int):
+        """Starts controlling a channel's slowmode"""
+        if channel_id not in self.windows:
+            self.windows[channel_id] = MessageWindow(self.window,
+                                                     self.max_messages)
+
+    def unwatch(self, channel_id: int):
+        """Stops controlling a channel's slowmode, leaving it as it is"""
+        self.windows.pop(channel_id, None)
+        self._last_edit.pop(channel_id, None)
+
+    def record(self, channel_id: int, author_id: int, now=None):
+        """Adds a message to its channel's window"""
+        self.windows[channel_id].add(
+            time.monotonic() if now is None else now, author_id)
+
+    def delay_for(self, channel_id: int, now=None) -> int:
+        """Returns the slowmode delay the channel's current rate calls for"""
+        window = self.windows[channel_id]
+        window.evict(time.monotonic() if now is None else now)
+        ratio = window.messages_per_author()
+        for limit, delay in self.thresholds:
+            if ratio >= limit:
+                return delay
+        return 0
+
+    async def update(self, channel, now=None):
+        """Edits channel's slowmode if the computed delay differs from it"""
+        if now is None:
+            now = time.monotonic()
+        delay = self.delay_for(channel.id, now)
+        if delay == channel.slowmode_delay:
+            return
+        last_edit = self._last_edit.get(channel.id)
+        if last_edit is not None and now - last_edit < self.min_edit_interval:
+            return
+        self._last_edit[channel.id] = now
+        logging.info("Setting slowmode in %s to %ss", channel, delay)
+        try:
+            await channel.edit(slowmode_delay=delay)
+            self.edits += 1
+        except discord.HTTPException as error:
+            logging.warning("Could not set slowmode in %s: %s", channel,
+                            error)
+
+    def start(self, get_channel):
+        """Starts rechecking every channel on a timer"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(
+                self._check_forever(get_channel))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _check_forever(self, get_channel):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for channel_id in list(self.windows):
+                channel = get_channel(channel_id)
+                if channel is not None:
+                    await self.update(channel)
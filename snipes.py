@@ -0,0 +1,167 @@
+"""Compact per-channel log of deleted and edited messages for mods"""
+import collections
+import time
+
+RECORD_OVERHEAD = 120  # Rough bytes per record besides its text
+
+
+class RecentMessage:
+    """What the log needs to know about a message that might be deleted"""
+
+    __slots__ = ("channel_id", "author_id", "created", "content")
+
+    def __init__(self, channel_id, author_id, created, content):
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.created = created
+        self.content = content
+
+    @property
+    def size(self) -> int:
+        return RECORD_OVERHEAD + len(self.content)
+
+
+class SnipeRecord:
+    """A deleted message, or an edit with the content before and after"""
+
+    __slots__ = ("message_id", "channel_id", "author_id", "when", "content",
+                 "edited_content", "evicted")
+
+    def __init__(self, message_id, channel_id, author_id, when, content,
+                 edited_content=None):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.when = when
+        self.content = content
+        self.edited_content = edited_content  # None for deletions
+        self.evicted = False
+
+    @property
+    def size(self) -> int:
+        return (RECORD_OVERHEAD + len(self.content) +
+                len(self.edited_content or ""))
+
+
+class SnipeLog:
+    """
+    Keeps the last per_channel deletions and edits of each channel in
+    a ring buffer, dropping the oldest first.
+    Message content is remembered on arrival for the last recent_max
+    messages, so deletions can be logged without discord.py's own (much
+    bulkier) message cache.
+    Records and remembered messages share one budget of max_bytes, and
+    whichever is oldest goes first when it runs out.
+    """
+
+    def __init__(self, per_channel=100, max_bytes=8 * 1024 * 1024,
+                 recent_max=5000):
+        self.per_channel = per_channel
+        self.max_bytes = max_bytes
+        self.recent_max = recent_max
+        self.bytes = 0
+        self.entries = 0
+        self._recent = collections.OrderedDict()  # message id -> RecentMessage
+        self._channels = {}  # channel id -> deque of SnipeRecord
+        self._order = collections.deque()  # Records oldest first, some evicted
+
+    def __len__(self):
+        return self.entries
+
+    def seen(self, message_id, channel_id, author_id, content):
+        """Remembers a new message's content in case it's deleted or edited"""
+        recent = RecentMessage(channel_id, author_id, time.time(), content)
+        replaced = self._recent.pop(message_id, None)
+        if replaced is not None:
+            self.bytes -= replaced.size
+        self._recent[message_id] = recent
+        self.bytes += recent.size
+        if len(self._recent) > self.recent_max:
+            self._forget_oldest_recent()
+        self._shrink()
+
+    def _forget_oldest_recent(self):
+        _, recent = self._recent.popitem(last=False)
+        self.bytes -= recent.size
+
+    def deleted(self, message_id, cached=None):
+        """
+        Logs a deletion, using discord.py's cached message if it has one
+        and we don't. Returns the record, or None if the content is unknown.
+        """
+        recent = self._recent.pop(message_id, None)
+        if recent is not None:
+            self.bytes -= recent.size
+            return self._add(
+                SnipeRecord(message_id, recent.channel_id, recent.author_id,
+                            time.time(), recent.content))
+        if cached is not None and not cached.author.bot:
+            return self._add(
+                SnipeRecord(message_id, cached.channel.id, cached.author.id,
+                            time.time(), cached.content))
+        return None
+
+    def edited(self, message_id, content, cached=None):
+        """Logs an edit to content, if the old content is known and differs"""
+        recent = self._recent.get(message_id)
+        if recent is not None:
+            before, channel_id, author_id = (recent.content,
+                                             recent.channel_id,
+                                             recent.author_id)
+            self.bytes += len(content) - len(recent.content)
+            recent.content = content
+        elif cached is not None and not cached.author.bot:
+            before, channel_id, author_id = (cached.content, cached.channel.id,
+                                             cached.author.id)
+        else:
+            return None
+        if before == content:
+            return None
+        return self._add(
+            SnipeRecord(message_id, channel_id, author_id, time.time(), before,
+                        content))
+
+    def _add(self, record):
+        buffer = self._channels.get(record.channel_id)
+        if buffer is None:
+            buffer = self._channels[record.channel_id] = collections.deque()
+        buffer.append(record)
+        self._order.append(record)
+        self.entries += 1
+        self.bytes += record.size
+        if len(buffer) > self.per_channel:
+            self._evict(buffer.popleft())
+        self._shrink()
+        return record
+
+    def _shrink(self):
+        while self.bytes > self.max_bytes and (self._order or self._recent):
+            # After _evict's cleanup the head is live, and the oldest record
+            # overall is also the oldest in its channel
+            oldest_recent = next(iter(self._recent.values()), None)
+            if self._order and (oldest_recent is None or
+                                self._order[0].when <= oldest_recent.created):
+                oldest = self._order[0]
+                self._channels[oldest.channel_id].popleft()
+                self._evict(oldest)
+            else:
+                self._forget_oldest_recent()
+
+    def _evict(self, record):
+        record.evicted = True
+        self.entries -= 1
+        self.bytes -= record.size
+        if not self._channels[record.channel_id]:
+            del self._channels[record.channel_id]
+        while self._order and self._order[0].evicted:
+            self._order.popleft()
+        # Records dropped from busy channels can sit behind a quiet channel's
+        # old one, so compact once they outnumber the live records
+        if len(self._order) > 2 * self.entries + 64:
+            self._order = collections.deque(
+                live for live in self._order if not live.evicted)
+
+    def latest(self, channel_id, count=5):
+        """Returns the channel's count most recent records, newest first"""
+        buffer = self._channels.get(channel_id, ())
+        return [buffer[-index] for index in range(1, min(count, len(buffer)) + 1)]
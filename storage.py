@@ -0,0 +1,209 @@
+"""Async access to omega.db without blocking the event loop"""
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import time
+
+MIGRATION_FILE = re.compile(r"(\d+)_\w+\.sql")
+
+
+class Storage:
+    """
+    Owns the bot's single sqlite connection and runs every statement on one
+    dedicated thread, so fsyncs never stall message handling.
+    The connection stays open for the life of the bot, uses WAL journaling
+    and keeps a cache of prepared statements.
+    Given a Metrics, query latency (including time queued behind other
+    queries) is recorded as db_query_seconds.
+    """
+
+    def __init__(self, path="omega.db", cached_statements=256, metrics=None):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.metrics = metrics
+        self._conn = None
+        self._executor = None
+
+    @property
+    def connected(self):
+        return self._conn is not None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args)
+
+    async def _query(self, operation, func, *args):
+        started = time.perf_counter()
+        try:
+            return await self._run(func, *args)
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe("db_query_seconds",
+                                     time.perf_counter() - started,
+                                     operation=operation)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path,
+                               cached_statements=self.cached_statements)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        return conn
+
+    async def connect(self):
+        """Opens the connection on the storage thread"""
+        if self._conn is not None:
+            return
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="omega-db")
+        self._conn = await self._run(self._connect)
+
+    async def close(self):
+        """Closes the connection and stops the storage thread"""
+        if self._conn is None:
+            return
+        await self._run(self._conn.close)
+        self._conn = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def _transact(self, func, args):
+        with self._conn:  # Commits on success, rolls back on error
+            return func(self._conn, *args)
+
+    async def transaction(self, func, *args):
+        """
+        Runs func(connection, *args) on the storage thread as one transaction
+        and returns its result.
+        """
+        return await self._query("transaction", self._transact, func, args)
+
+    async def execute(self, sql: str, params=()):
+        """Runs a single write statement and commits it"""
+        await self.transaction(lambda conn: conn.execute(sql, params))
+
+    async def executescript(self, script: str):
+        """Runs a multi-statement script"""
+        await self.transaction(lambda conn: conn.executescript(script))
+
+    def _migrate(self, migrations):
+        version = self._conn.execute("PRAGMA user_version;").fetchone()[0]
+        for number, path in migrations:
+            if number <= version:
+                continue
+            with open(path) as script:
+                sql = script.read()
+            # Takes the write lock before rechecking the version, in case
+            # another shard process applied this migration in the meantime
+            self._conn.execute("BEGIN IMMEDIATE;")
+            try:
+                version = self._conn.execute(
+                    "PRAGMA user_version;").fetchone()[0]
+                if number > version:
+                    logging.info("Applying migration %s", path)
+                    for statement in _statements(sql):
+                        self._conn.execute(statement)
+                    self._conn.execute(f"PRAGMA user_version = {number};")
+                    version = number
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+        return version
+
+    async def migrate(self, directory="migrations") -> int:
+        """
+        Applies each NNNN_name.sql script in directory numbered above the
+        database's user_version, in order and each in its own transaction,
+        and returns the version the database ends up at.
+        """
+        migrations = sorted(
+            (int(match.group(1)), os.path.join(directory, name))
+            for match, name in ((MIGRATION_FILE.fullmatch(name), name)
+                                for name in os.listdir(directory))
+            if match)
+        return await self._run(self._migrate, migrations)
+
+    async def fetchone(self, sql: str, params=()):
+        """Returns the first row of a query, or None"""
+        return await self._query(
+            "fetchone", lambda: self._conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params=()):
+        """Returns every row of a query"""
+        return await self._query(
+            "fetchall", lambda: self._conn.execute(sql, params).fetchall())
+
+    async def iterate(self, sql: str, params=(), batch_size=1000):
+        """Yields the rows of a query, fetching batch_size rows at a time"""
+        cursor = await self._run(self._conn.execute, sql, params)
+        try:
+            while True:
+                rows = await self._run(cursor.fetchmany, batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            await self._run(cursor.close)
+
+
+def _statements(script: str):
+    """Splits a SQL script into its statements"""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+
+def _apply_writes(conn, statements):
+    # Consecutive statements with the same SQL go through one executemany
+    for sql, group in itertools.groupby(statements, key=lambda item: item[0]):
+        conn.executemany(sql, [row for _, rows in group for row in rows])
+
+
+class WriteBatcher:
+    """
+    Collects writes from concurrent callers and commits everything that
+    arrives within window seconds as a single transaction, so a burst of
+    commands costs one fsync instead of one per statement.
+    """
+
+    def __init__(self, storage: Storage, window=0.05):
+        self.storage = storage
+        self.window = window
+        self.transactions = 0
+        self.statements = 0
+        self._pending = []
+        self._committed = None
+
+    async def write(self, *statements):
+        """
+        Queues (sql, rows) pairs, rows being a list of parameter tuples,
+        and waits until the transaction that contains them has committed.
+        If that transaction fails, every caller in it gets the error.
+        """
+        if self._committed is None:
+            loop = asyncio.get_running_loop()
+            self._committed = loop.create_future()
+            loop.call_later(self.window,
+                            lambda: asyncio.ensure_future(self._flush()))
+        self._pending.extend(statements)
+        await asyncio.shield(self._committed)
+
+    async def _flush(self):
+        statements, committed = self._pending, self._committed
+        self._pending, self._committed = [], None
+        try:
+            await self.storage.transaction(_apply_writes, statements)
+        except Exception as error:
+            committed.set_exception(error)
+        else:
+            self.transactions += 1
+            self.statements += len(statements)
+            committed.set_result(None)
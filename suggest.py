@@ -0,0 +1,103 @@
+"""Closest-command lookup for mistyped command names"""
+
+
+def damerau_levenshtein(first: str, second: str) -> int:
+    """
+    Returns the edit distance counting insertions, deletions, substitutions
+    and transpositions of adjacent characters, all at cost 1.
+    This is the unrestricted distance, which unlike optimal string
+    alignment is a metric, as the BK-tree below needs.
+    """
+    infinity = len(first) + len(second)
+    last_row = {}  # character -> last row of first it appeared in
+    rows = [[infinity] * (len(second) + 2)]
+    rows.append([infinity] + list(range(len(second) + 1)))
+    for i, first_char in enumerate(first, 1):
+        row = [infinity, i] + [0] * len(second)
+        last_match = 0  # Last column of this row where the characters matched
+        for j, second_char in enumerate(second, 1):
+            k = last_row.get(second_char, 0)
+            cost = first_char != second_char
+            row[j + 1] = min(
+                rows[i][j] + cost,
+                rows[i][j + 1] + 1,
+                row[j] + 1,
+                rows[k][last_match] + (i - k - 1) + 1 + (j - last_match - 1),
+            )
+            if not cost:
+                last_match = j
+        last_row[first_char] = i
+        rows.append(row)
+    return rows[-1][-1]
+
+
+class CommandIndex:
+    """
+    BK-tree over command names and aliases, so finding the closest name to
+    a typo only measures the distance to a few names instead of all of
+    them. Built once after every command is registered.
+    """
+
+    __slots__ = ("_root", "_commands", "comparisons")
+
+    def __init__(self):
+        self._root = None  # (name, {distance: child node})
+        self._commands = {}  # name or alias -> command
+        self.comparisons = 0
+
+    def __len__(self):
+        return len(self._commands)
+
+    def add(self, name: str, command):
+        if name in self._commands:
+            return
+        self._commands[name] = command
+        node = (name, {})
+        if self._root is None:
+            self._root = node
+            return
+        parent = self._root
+        while True:
+            distance = damerau_levenshtein(name, parent[0])
+            child = parent[1].get(distance)
+            if child is None:
+                parent[1][distance] = node
+                return
+            parent = child
+
+    def rebuild(self, commands):
+        """Indexes every visible command's name and aliases"""
+        self._root = None
+        self._commands = {}
+        for command in commands:
+            if command.hidden:
+                continue
+            for name in (command.name, *command.aliases):
+                self.add(name, command)
+
+    def closest(self, word: str, max_distance=2):
+        """
+        Returns (distance, name, command) for the indexed name nearest to
+        word, or None if nothing is within max_distance.
+        """
+        matches = self.within(word, max_distance)
+        return matches[0] if matches else None
+
+    def within(self, word: str, max_distance=2):
+        """
+        Returns (distance, name, command) for every indexed name within
+        max_distance of word, nearest first.
+        """
+        found = []
+        pending = [self._root] if self._root is not None else []
+        while pending:
+            name, children = pending.pop()
+            distance = damerau_levenshtein(word, name)
+            self.comparisons += 1
+            if distance <= max_distance:
+                found.append((distance, name, self._commands[name]))
+            # Triangle inequality: only these subtrees can hold a match
+            pending.extend(child for child_distance, child in children.items()
+                           if abs(child_distance - distance) <= max_distance)
+        found.sort(key=lambda match: match[:2])
+        return found
@@ -1,5 +1,32 @@
 """test function"""
+import asyncio
+import random
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import dice
+import guilds
+import discord
+
 import main
+import notifier
+import pins
+import reactions
+import reports
+import search
+import slowmode
+import snipes
+import storage
+import watchwords
+
+
+async def search_once(term, pseid):
+    try:
+        return await main.search_helper(term, pseid)
+    finally:
+        await main.OMEGA.http_client.close()
 
 
 def test_scott_post_helper():
@@ -7,7 +34,7 @@ def test_scott_post_helper():
     queries = ("", "melatonin")
     for term in queries:
         try:
-            main.search_helper(term, "7e281d64bc7d22cb7")
+            asyncio.run(search_once(term, "7e281d64bc7d22cb7"))
         except FileNotFoundError:
             print("FAILURE: test_scott_post_helper()")
             print(
@@ -28,7 +55,666 @@ def test_scott_post_helper():
         print("SUCCESS: test_scott_post_helper()")
 
 
+def test_scott_links_search():
+    links = search.LinkCorpus("scott_links.txt")
+    expected = ("https://slatestarcodex.com/2020/06/15/"
+                "the-vision-of-vilazodone-and-vortioxetine/")
+    found = links.search(["Vilazodone"])
+    missing = links.search(["vilazodone", "xyzzy"])
+    if found != [expected] or missing:
+        print("FAILURE: test_scott_links_search()")
+        print(f"Expected [{expected}] and [] but got {found} and {missing}")
+    else:
+        print("SUCCESS: test_scott_links_search()")
+
+
+def test_watchword_matcher():
+    matcher = watchwords.WatchwordMatcher(["lorem", "lorem ipsum", "sum do"])
+    cases = (
+        ("lorem ipsum dolor", {"lorem", "lorem ipsum", "sum do"}),
+        ("loremipsum", set()),
+        ("xlorem ipsumy", {"lorem ipsum"}),
+        ("ipsum", set()),
+    )
+    failure = False
+    for content, expected in cases:
+        found = matcher.match(content)
+        if found != expected:
+            print("FAILURE: test_watchword_matcher()")
+            print(f"Expected {expected} for '{content}' but got {found}")
+            failure = True
+    matcher.discard("lorem ipsum")
+    matcher.add("dolor")
+    found = matcher.match("lorem ipsum dolor")
+    if found != {"lorem", "sum do", "dolor"}:
+        print("FAILURE: test_watchword_matcher()")
+        print(f"Expected the matcher to follow add/discard but got {found}")
+        failure = True
+    if not failure:
+        print("SUCCESS: test_watchword_matcher()")
+
+
+def test_watchword_registry_reload():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            db = storage.Storage(os.path.join(tmp, "test.db"))
+            await db.connect()
+            await db.migrate()
+            await db.executescript(
+                "INSERT INTO watchword (guild_id, user_id, word, channels) "
+                "VALUES (1, 10, 'lorem', NULL), (1, 11, 'lorem', '[5]'), "
+                "(2, 12, 'lorem', NULL);")
+            registry = watchwords.WatchwordRegistry()
+            await registry.reload(db, 1)
+            await db.close()
+            return registry
+
+    registry = asyncio.run(run())
+    subscribers = sorted(registry.subscribers("lorem"))
+    if subscribers != [10, 11] or registry.channels("lorem", 11) != {5}:
+        print("FAILURE: test_watchword_registry_reload()")
+        print("Expected users 10 and 11 (filtered to channel 5) watching "
+              f"'lorem' but got {subscribers}")
+    else:
+        print("SUCCESS: test_watchword_registry_reload()")
+
+
+def test_watchword_channel_filter():
+    registry = watchwords.WatchwordRegistry()
+    registry.add("lorem", 10)
+    registry.add("lorem", 11, channels=[5, 6])
+    allowed = [(user, channel) for user in (10, 11) for channel in (5, 7)
+               if registry.watches_in("lorem", user, channel)]
+    if allowed != [(10, 5), (10, 7), (11, 5)]:
+        print("FAILURE: test_watchword_channel_filter()")
+        print("Expected user 11 to only hear about channels 5 and 6 but got "
+              f"{allowed}")
+    else:
+        print("SUCCESS: test_watchword_channel_filter()")
+
+
+def test_cooldown_throttle():
+    failure = False
+    throttle = watchwords.CooldownThrottle(resolution=1, slots=8,
+                                           max_entries=100)
+    results = [
+        throttle.allow("a", 30, now=0),
+        throttle.allow("a", 30, now=10),  # Cooling down
+        throttle.allow("b", 30, now=10),  # Other keys are independent
+        throttle.allow("a", 30, now=31),  # Expired
+    ]
+    if results != [True, False, True, True]:
+        print("FAILURE: test_cooldown_throttle()")
+        print(f"Expected [True, False, True, True] but got {results}")
+        failure = True
+    throttle.allow("c", 5, now=100)
+    if "b" in throttle._until or "c" not in throttle._until:
+        print("FAILURE: test_cooldown_throttle()")
+        print("Expected the sweep to drop b's expired cooldown and keep c's")
+        failure = True
+    throttle = watchwords.CooldownThrottle(max_entries=100)
+    for step in range(100000):
+        throttle.allow(step % 500, 5, now=step * 0.001)
+    wheel = sum(map(len, throttle._wheel))
+    if len(throttle) > 100 or wheel > 100:
+        print("FAILURE: test_cooldown_throttle()")
+        print(f"Expected at most 100 entries but got {len(throttle)} keys "
+              f"and {wheel} wheel entries")
+        failure = True
+    throttle = watchwords.CooldownThrottle(max_entries=2)
+    throttle.allow("a", 5, now=0)
+    throttle.allow("b", 1000, now=1)
+    throttle.allow("a", 1000, now=6)  # Re-armed after expiring...
+    throttle.allow("c", 1000, now=7)  # ...so b is the one evicted
+    if sorted(throttle._until) != ["a", "c"]:
+        print("FAILURE: test_cooldown_throttle()")
+        print("Expected the longest-armed key to be evicted but kept "
+              f"{sorted(throttle._until)}")
+        failure = True
+    if not failure:
+        print("SUCCESS: test_cooldown_throttle()")
+
+
+def test_storage_does_not_block():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            db = storage.Storage(os.path.join(tmp, "test.db"))
+            await db.connect()
+            await db.migrate()
+            longest_stall = 0
+            writing = True
+
+            async def tick():
+                nonlocal longest_stall
+                while writing:
+                    before = time.perf_counter()
+                    await asyncio.sleep(0)
+                    longest_stall = max(longest_stall,
+                                        time.perf_counter() - before)
+
+            ticker = asyncio.ensure_future(tick())
+            for user_id in range(200):
+                await db.execute("INSERT INTO user (user_id) VALUES (?);",
+                                 (user_id,))
+            count = (await db.fetchone("SELECT COUNT(*) FROM user;"))[0]
+            writing = False
+            await ticker
+            await db.close()
+            return count, longest_stall
+
+    count, longest_stall = asyncio.run(run())
+    if count != 200 or longest_stall > 0.05:
+        print("FAILURE: test_storage_does_not_block()")
+        print(f"Expected 200 rows with the event loop never stalled, "
+              f"but got {count} rows and a {longest_stall:.3f}s stall")
+    else:
+        print("SUCCESS: test_storage_does_not_block()")
+
+
+def test_message_dispatcher():
+    class Recipient:
+        def __init__(self, recipient_id, error=None):
+            self.id = recipient_id
+            self.error = error
+            self.received = []
+
+        async def send(self, content):
+            if self.error is not None:
+                raise self.error
+            self.received.append(content)
+
+    async def run():
+        dispatcher = notifier.MessageDispatcher(concurrency=2,
+                                                coalesce_window=0.05)
+        first = Recipient(1)
+        blocked = Recipient(2, discord.Forbidden(
+            SimpleNamespace(status=403, reason="Forbidden"), "Blocked"))
+        last = Recipient(3)
+        for word in ("lorem", "ipsum", "dolor"):
+            dispatcher.submit(first, word)
+        dispatcher.submit(first, "sit", coalesce=False)
+        dispatcher.submit(blocked, "amet")
+        dispatcher.submit(last, "consectetur")
+        await asyncio.sleep(0.2)
+        await dispatcher.close()
+        return (sorted(first.received), last.received, dispatcher.sent,
+                dispatcher.failed, dispatcher.coalesced)
+
+    result = asyncio.run(run())
+    expected = (["lorem\n\nipsum\n\ndolor", "sit"], ["consectetur"], 3, 1, 2)
+    if result != expected:
+        print("FAILURE: test_message_dispatcher()")
+        print("Expected coalesced DMs and a blocked recipient not affecting "
+              f"the others, {expected}, but got {result}")
+    else:
+        print("SUCCESS: test_message_dispatcher()")
+
+
+def test_search_cache():
+    fetches = []
+    release = None
+
+    def fetcher(result):
+        async def fetch():
+            fetches.append(result)
+            await release.wait()
+            return result
+
+        return fetch
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        cache = search.SearchCache(ttl=60, max_size=2)
+        # Trivial variants of one query share a single request
+        waiting = [
+            asyncio.ensure_future(cache.get("cx", query, fetcher("a")))
+            for query in ("Lorem  ipsum", "lorem ipsum", "LOREM IPSUM")
+        ]
+        await asyncio.sleep(0.01)
+        release.set()
+        shared = await asyncio.gather(*waiting)
+        await cache.get("cx", "b", fetcher("b"))
+        await cache.get("cx", "lorem ipsum", fetcher("x"))  # Hit, now newest
+        await cache.get("cx", "c", fetcher("c"))  # Evicts b
+        await cache.get("cx", "b", fetcher("b"))
+        cache._entries[("cx", "c")] = (time.time() - 1, "c")
+        await cache.get("cx", "c", fetcher("c"))
+        return shared, (cache.hits, cache.misses, cache.shared,
+                        cache.evictions, cache.expirations)
+
+    shared, counts = asyncio.run(run())
+    if (shared != ["a", "a", "a"] or fetches != ["a", "b", "c", "b", "c"] or
+            counts != (1, 5, 2, 2, 1)):
+        print("FAILURE: test_search_cache()")
+        print("Expected one shared request, LRU eviction and TTL expiry but "
+              f"got {shared}, fetches {fetches} and counts {counts}")
+    else:
+        print("SUCCESS: test_search_cache()")
+
+
+def test_slowmode_controller():
+    class Channel:
+        id = 5
+        slowmode_delay = 0
+
+        async def edit(self, slowmode_delay):
+            self.slowmode_delay = slowmode_delay
+
+    async def run():
+        controller = slowmode.SlowmodeController([5], {2: 10, 5: 30},
+                                                 window=60,
+                                                 min_edit_interval=30)
+        channel = Channel()
+        delays = []
+        for second in range(10):  # One author flooding the channel
+            controller.record(5, 1, now=second)
+        await controller.update(channel, now=10)
+        delays.append(channel.slowmode_delay)
+        for author in range(2, 6):  # 14 messages from 5 authors
+            controller.record(5, author, now=10 + author)
+        await controller.update(channel, now=20)  # Too soon to edit again
+        delays.append(channel.slowmode_delay)
+        await controller.update(channel, now=45)
+        delays.append(channel.slowmode_delay)
+        await controller.update(channel, now=200)  # All out of the window
+        delays.append(channel.slowmode_delay)
+        return delays, controller.edits
+
+    result = asyncio.run(run())
+    if result != ([30, 30, 10, 0], 3):
+        print("FAILURE: test_slowmode_controller()")
+        print("Expected slowmode raised to 30s, relaxed to 10s no sooner "
+              f"than min_edit_interval and then off, but got {result}")
+    else:
+        print("SUCCESS: test_slowmode_controller()")
+
+
+def test_guild_states():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            db = storage.Storage(os.path.join(tmp, "test.db"))
+            await db.connect()
+            await db.migrate()
+            states = guilds.GuildStates(
+                db, storage.WriteBatcher(db),
+                lambda: slowmode.SlowmodeController((), {10: 5}),
+                lambda channel_id: None)
+            await db.executescript(
+                "INSERT INTO channel (channel_id, guild_id, radio) "
+                "VALUES (20, 1, 1), (30, 2, 1);"
+                "INSERT INTO watchword (guild_id, user_id, word) "
+                "VALUES (1, 10, 'lorem'), (2, 11, 'ipsum');")
+            await states.seed(1, slowmode_channel_ids=[21], mod_channel_id=5,
+                              cw_role_name="Muted")
+            # Only the first seed counts, later config lives in the database
+            await states.seed(1, slowmode_channel_ids=[22], mod_channel_id=6)
+            first, second = await states.load(1), await states.load(2)
+            seeded = (first.mod_channel_id, set(first.radio_channels),
+                      set(first.slowmode.windows),
+                      sorted(first.watchwords.subscriber_ids()),
+                      set(second.radio_channels),
+                      sorted(second.watchwords.subscriber_ids()))
+            channel = SimpleNamespace(id=21, guild=SimpleNamespace(id=1))
+            toggled = (await states.toggle_channel(channel, "slowmode"),
+                       await states.toggle_channel(channel, "radio"))
+            await states.configure(1, "mod", 7)
+            await states.configure(1, "cw_contact", "a mod")
+            reloaded = await states.load(1)
+            after = (reloaded.mod_channel_id, set(reloaded.radio_channels),
+                     set(reloaded.slowmode.windows), reloaded.cw_role_name,
+                     reloaded.cw_contact, reloaded.cw_rules_url)
+            states.close()
+            await db.close()
+            return seeded, toggled, after
+
+    seeded, toggled, after = asyncio.run(run())
+    expected = ((5, {20}, {21}, [10], {30}, [11]), (False, True),
+                (7, {20, 21}, set(), "Muted", "a mod", None))
+    if (seeded, toggled, after) != expected:
+        print("FAILURE: test_guild_states()")
+        print(f"Expected {expected} but got {(seeded, toggled, after)}")
+    else:
+        print("SUCCESS: test_guild_states()")
+
+
+def test_roll_dice():
+    rng = random.Random(0)
+    failure = False
+    for _ in range(200):
+        total, parts = dice.parse("4d6kh3 + 2d8 - 1").roll(rng)
+        (_, _, (kept, rolls, dropped)), (_, _, (eights, _, _)), _ = parts
+        if (len(rolls) != 4 or len(dropped) != 1 or
+                min(rolls) not in (rolls[i] for i in dropped) or
+                total != kept + eights - 1 or not 4 <= total <= 33):
+            print("FAILURE: test_roll_dice()")
+            print(f"Expected 4d6kh3 + 2d8 - 1 to drop the lowest d6 but got "
+                  f"{parts}")
+            failure = True
+            break
+    answer = main.roll_dice_helper("100x50000d6")
+    if len(answer) > 2000 or not answer.startswith("You rolled 100x"):
+        print("FAILURE: test_roll_dice()")
+        print(f"Expected a bulk roll under 2000 characters but got "
+              f"{len(answer)}")
+        failure = True
+    if not main.roll_dice_helper("3d").startswith("I couldn't understand"):
+        print("FAILURE: test_roll_dice()")
+        print("Expected a format hint for '3d'")
+        failure = True
+    if not failure:
+        print("SUCCESS: test_roll_dice()")
+
+
+def test_pin_cache():
+    pinned = [1, 2]
+
+    class PinChannel:
+        id = 5
+
+        async def pins(self):
+            return [SimpleNamespace(id=message_id) for message_id in pinned]
+
+        def get_partial_message(self, message_id):
+
+            class Partial:
+                async def pin(self):
+                    if message_id < 0:
+                        raise discord.HTTPException(
+                            SimpleNamespace(status=400, reason="Bad"), "")
+                    if message_id not in pinned:
+                        pinned.insert(0, message_id)
+
+            return Partial()
+
+    async def run():
+        cache, channel = pins.PinCache(), PinChannel()
+        seeds = []
+        await cache.pins(channel)
+        await cache.pin(channel, 1)  # Already pinned, so no update comes
+        cache.pins_updated(5)  # Someone pinned by hand
+        await cache.pins(channel)
+        seeds.append(cache.seeds)
+        await cache.pin(channel, 3)
+        cache.pins_updated(5)  # Ours, keep the list
+        seeds.append(cache.seeds)
+        try:
+            await cache.pin(channel, -1)
+        except discord.HTTPException:
+            pass
+        cache.pins_updated(5)  # By hand, not swallowed by the failed pin
+        await cache.pins(channel)
+        seeds.append(cache.seeds)
+        cache._expected[5].append(time.monotonic() - 1)  # Never arrived
+        cache.pins_updated(5)
+        await cache.pins(channel)
+        seeds.append(cache.seeds)
+        return seeds, await cache.pins(channel)
+
+    seeds, kept = asyncio.run(run())
+    if seeds != [2, 2, 3, 4] or kept != [3, 1, 2]:
+        print("FAILURE: test_pin_cache()")
+        print("Expected only manual pin updates and expired expectations to "
+              f"refetch but got seeds {seeds} and pins {kept}")
+    else:
+        print("SUCCESS: test_pin_cache()")
+
+
+class FakeChannel:
+    """Collects what the report queue posts and edits"""
+
+    def __init__(self):
+        self.posts = {}  # message id -> content
+        self.sent = 0
+        self.edits = 0
+
+    async def send(self, content):
+        self.sent += 1
+        message_id = self.sent
+        self.posts[message_id] = content
+        return SimpleNamespace(id=message_id)
+
+    def get_partial_message(self, message_id):
+        channel = self
+
+        class Partial:
+            async def edit(self, content):
+                if message_id not in channel.posts:
+                    raise discord.NotFound(
+                        SimpleNamespace(status=404, reason="Not Found"),
+                        "Unknown Message")
+                channel.posts[message_id] = content
+                channel.edits += 1
+
+        return Partial()
+
+
+class FakeWrites:
+
+    def __init__(self):
+        self.statements = []
+
+    async def write(self, *statements):
+        self.statements.extend(statements)
+
+
+def fake_message(message_id, author_id, content="lorem ipsum"):
+    return SimpleNamespace(id=message_id,
+                           channel=SimpleNamespace(id=5),
+                           author=SimpleNamespace(id=author_id),
+                           content=content,
+                           jump_url=f"https://discord.com/{message_id}")
+
+
+def test_report_queue():
+    failure = False
+
+    async def run():
+        nonlocal failure
+        channel = FakeChannel()
+        queue = reports.ReportQueue(None, FakeWrites(), edit_delay=0.05)
+        message = fake_message(100, 1)
+        first = [queue.report_again(channel, 100, 2)]  # Unknown, so fetch
+        first += [queue.report(channel, message, reporter)
+                  for reporter in (2, 2, 3)]
+        await asyncio.sleep(0.01)  # Posted right away
+        first.append(queue.report_again(channel, 100, 3))
+        for reporter in range(4, 24):  # One debounced edit for all of these
+            queue.report_again(channel, 100, reporter)
+        await asyncio.sleep(0.2)
+        if (first != [None, True, False, True, False] or
+                len(channel.posts) != 1 or
+                channel.edits != 1 or
+                "22 reports" not in channel.posts[1]):
+            print("FAILURE: test_report_queue()")
+            print("Expected 22 distinct reports in one post and one edit but "
+                  f"got {first}, {len(channel.posts)} posts and "
+                  f"{channel.edits} edits")
+            failure = True
+        del channel.posts[1]  # A mod deleted it
+        queue.report(channel, message, 24)
+        await asyncio.sleep(0.2)
+        if len(channel.posts) != 1 or "23 reports" not in channel.posts[2]:
+            print("FAILURE: test_report_queue()")
+            print("Expected the report to be posted again after NotFound")
+            failure = True
+        opened = [
+            queue.modmail(channel, fake_message(200 + index, 9, "x" * 900))
+            for index in range(3)
+        ]
+        opened.append(queue.modmail(channel, fake_message(202, 9)))
+        queue._tickets[9].updated -= reports.TICKET_IDLE + 1
+        opened.append(queue.modmail(channel, fake_message(203, 9)))
+        await asyncio.sleep(0.2)
+        if opened != [True, False, True, None, True]:
+            print("FAILURE: test_report_queue()")
+            print("Expected tickets to roll over at 2000 characters and after "
+                  f"TICKET_IDLE, and repeats ignored, but got {opened}")
+            failure = True
+
+    asyncio.run(run())
+    if not failure:
+        print("SUCCESS: test_report_queue()")
+
+
+def test_report_queue_loads_once():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            db = storage.Storage(os.path.join(tmp, "test.db"))
+            await db.connect()
+            await db.migrate()
+            await db.execute(
+                "INSERT INTO report (message_id, channel_id, author_id, "
+                "content, jump_url, reporters, mod_message_id, updated) "
+                "VALUES (100, 5, 1, 'lorem', 'url', '[2]', 1, ?);",
+                (time.time(),))
+            queue = reports.ReportQueue(db, FakeWrites(), edit_delay=0.05)
+            await queue.load()
+            loaded = queue._reports[100]
+            queue.report_again(FakeChannel(), 100, 3)
+            await queue.load()  # ie on_ready after a reconnect
+            kept = queue._reports[100] is loaded and loaded.reporters
+            await asyncio.sleep(0.1)
+            await db.close()
+            return kept
+
+    kept = asyncio.run(run())
+    if kept != [2, 3]:
+        print("FAILURE: test_report_queue_loads_once()")
+        print("Expected a second load to keep the pending report [2, 3] but "
+              f"got {kept}")
+    else:
+        print("SUCCESS: test_report_queue_loads_once()")
+
+
+def test_reaction_rules():
+    failure = False
+    fetched = []
+    removed = []
+
+    async def fetch_counts(channel_id, message_id):
+        fetched.append(message_id)
+        return {"berk": 2}
+
+    async def remove(payload):
+        removed.append(payload.message_id)
+
+    def payload(message_id, emoji, user_id=1):
+        return SimpleNamespace(message_id=message_id, channel_id=5,
+                               user_id=user_id, emoji=emoji)
+
+    async def run():
+        rules = reactions.ReactionRules(fetch_counts, capacity=2)
+        rules.require("3berk", "berk", 3, remove)
+        await rules.reaction_added(payload(1, "3berk"))  # Seeds 2 berks
+        await rules.reaction_added(payload(1, "berk"))  # Tracked, no refetch
+        await rules.reaction_added(payload(1, "3berk"))  # 3 berks, allowed
+        rules.reaction_removed(payload(1, "berk"))
+        await rules.reaction_added(payload(1, "3berk"))  # Back to 2
+        counts = dict(rules._counts[1])
+        await rules.reaction_added(payload(2, "3berk"))
+        await rules.reaction_added(payload(3, "3berk"))  # Evicts message 1
+        await rules.reaction_added(payload(1, "3berk"))  # Refetched
+        return counts, list(rules._counts)
+
+    counts, cached = asyncio.run(run())
+    if removed != [1, 1, 2, 3, 1] or counts != {"berk": 2, "3berk": 2}:
+        print("FAILURE: test_reaction_rules()")
+        print("Expected 3berk removed with 2 berks and allowed with 3 but "
+              f"got removals {removed} and counts {counts}")
+        failure = True
+    if fetched != [1, 2, 3, 1] or cached != [3, 1]:
+        print("FAILURE: test_reaction_rules()")
+        print("Expected each message fetched once until evicted from the "
+              f"LRU but got fetches {fetched} and cache {cached}")
+        failure = True
+    if not failure:
+        print("SUCCESS: test_reaction_rules()")
+
+
+def test_snipe_log():
+    log = snipes.SnipeLog(per_channel=3, max_bytes=2000, recent_max=1000)
+    for message_id in range(100):
+        log.seen(message_id, message_id % 4, 1, "x" * 100)
+    for message_id in range(100):
+        log.deleted(message_id)
+    kept = [record.message_id for record in log.latest(3, count=10)]
+    live = sum(record.size for buffer in log._channels.values()
+               for record in buffer)
+    failure = False
+    if kept != [99, 95, 91] or log.bytes > 2000 or log.bytes != live:
+        print("FAILURE: test_snipe_log()")
+        print(f"Expected channel 3 to keep [99, 95, 91] within 2000 bytes "
+              f"but got {kept} in {log.bytes} bytes")
+        failure = True
+    log = snipes.SnipeLog(per_channel=100)
+    log.seen(0, 9, 1, "quiet channel")
+    log.deleted(0)
+    for message_id in range(1, 200001):
+        log.seen(message_id, 1, 1, "x")
+        log.deleted(message_id)
+    if len(log) != 101 or len(log._order) > 2 * len(log) + 64:
+        print("FAILURE: test_snipe_log()")
+        print(f"Expected 101 records and a bounded order but got {len(log)} "
+              f"records and {len(log._order)} in order")
+        failure = True
+    log = snipes.SnipeLog(per_channel=1)
+    for message_id in range(3):
+        log.seen(message_id, 1, 1, "y")
+        log.deleted(message_id)
+    kept = [record.message_id for record in log.latest(1)]
+    if kept != [2]:
+        print("FAILURE: test_snipe_log()")
+        print(f"Expected a one-record channel to keep [2] but got {kept}")
+        failure = True
+    log = snipes.SnipeLog(max_bytes=10000)
+    for message_id in range(20):
+        log.seen(message_id, 1, 1, "z" * 1000)
+        log.deleted(message_id - 10)
+    held = (sum(record.size for record in log.latest(1, count=100)) +
+            sum(recent.size for recent in log._recent.values()))
+    if log.bytes > 10000 or log.bytes != held or not log._recent:
+        print("FAILURE: test_snipe_log()")
+        print("Expected remembered messages to share the 10000 byte budget "
+              f"but got {log.bytes} bytes for {held} held")
+        failure = True
+    if not failure:
+        print("SUCCESS: test_snipe_log()")
+
+
 print("----------------------------------------------------------------------")
 print("Testing scott_post_helper...")
 test_scott_post_helper()
+print("Testing scott_links_search...")
+test_scott_links_search()
+print("Testing watchword_matcher...")
+test_watchword_matcher()
+print("Testing watchword_registry_reload...")
+test_watchword_registry_reload()
+print("Testing watchword_channel_filter...")
+test_watchword_channel_filter()
+print("Testing cooldown_throttle...")
+test_cooldown_throttle()
+print("Testing storage...")
+test_storage_does_not_block()
+print("Testing message_dispatcher...")
+test_message_dispatcher()
+print("Testing search_cache...")
+test_search_cache()
+print("Testing slowmode_controller...")
+test_slowmode_controller()
+print("Testing guild_states...")
+test_guild_states()
+print("Testing roll_dice...")
+test_roll_dice()
+print("Testing pin_cache...")
+test_pin_cache()
+print("Testing reaction_rules...")
+test_reaction_rules()
+print("Testing report_queue...")
+test_report_queue()
+print("Testing report_queue_loads_once...")
+test_report_queue_loads_once()
+print("Testing snipe_log...")
+test_snipe_log()
 print("All done!")
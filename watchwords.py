@@ -0,0 +1,335 @@
+"""Watchword storage and matching for the notify_on_watchword listener"""
+import array
+import collections
+import sys
+import time
+
+import ujson
+
+DEFAULT_COOLDOWN = 900  # Matches the watchword.cooldown column default
+
+
+class WatchwordMatcher:
+    """
+    Finds every watched word/phrase in a message in one pass over it.
+    Single words are looked up token by token in a set. Phrases (anything
+    containing a space) live in an Aho-Corasick automaton over characters,
+    so they keep matching as substrings of the whole message like before.
+    """
+
+    def __init__(self, words=()):
+        self.words = set()
+        self.phrases = set()
+        self._reset_automaton()
+        for word in words:
+            self.add(word)
+
+    def __contains__(self, word):
+        return word in self.words or word in self.phrases
+
+    def __len__(self):
+        return len(self.words) + len(self.phrases)
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes held by the sets and trie (not the strings)"""
+        size = sys.getsizeof(self.words) + sys.getsizeof(self.phrases)
+        if self._goto is not None:
+            size += sum(map(sys.getsizeof, self._goto))
+            for nodes in (self._goto, self._fail, self._terminal, self._report):
+                size += sys.getsizeof(nodes)
+        return size
+
+    def _reset_automaton(self):
+        # Parallel lists indexed by node number; node 0 is the root.
+        self._goto = [{}]
+        self._fail = [0]
+        self._terminal = [None]
+        self._report = [0]  # Nearest terminal node along the failure chain
+        self._stale = False
+
+    def add(self, word: str):
+        """Starts matching word, extending the phrase trie in place"""
+        if not word:
+            return
+        if " " not in word:
+            self.words.add(word)
+            return
+        if word in self.phrases:
+            return
+        self.phrases.add(word)
+        if self._goto is None:
+            return  # A rebuild is already pending and will pick it up
+        node = 0
+        for char in word:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto[node][char] = child
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._report.append(0)
+            node = child
+        self._terminal[node] = word
+        self._stale = True
+
+    def discard(self, word: str):
+        """Stops matching word; the phrase trie is rebuilt on next match"""
+        if " " not in word:
+            self.words.discard(word)
+            return
+        if word in self.phrases:
+            self.phrases.remove(word)
+            self._goto = None
+
+    def _link(self):
+        """Recomputes failure links breadth-first after the trie changed"""
+        if self._goto is None:
+            phrases = self.phrases
+            self.phrases = set()
+            self._reset_automaton()
+            for phrase in phrases:
+                self.add(phrase)
+        goto, fail, terminal, report = (self._goto, self._fail,
+                                        self._terminal, self._report)
+        queue = collections.deque()
+        for child in goto[0].values():
+            fail[child] = 0
+            report[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fallback = goto[state].get(char, 0)
+                fail[child] = fallback
+                report[child] = (fallback if terminal[fallback] is not None
+                                 else report[fallback])
+                queue.append(child)
+        self._stale = False
+
+    def match(self, content: str, tokens=None) -> set:
+        """
+        Returns the set of watchwords found in content, which should already
+        be lowercased and stripped of punctuation. tokens defaults to
+        content.split() and can be passed in if the caller already has it.
+        """
+        if tokens is None:
+            tokens = content.split()
+        found = self.words.intersection(tokens)
+        if not self.phrases:
+            return found
+        if self._stale or self._goto is None:
+            self._link()
+        goto, fail, terminal, report = (self._goto, self._fail,
+                                        self._terminal, self._report)
+        state = 0
+        for char in content:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            hit = state if terminal[state] is not None else report[state]
+            while hit:
+                found.add(terminal[hit])
+                hit = report[hit]
+        return found
+
+
+def parse_channels(value):
+    """Parses the watchword.channels JSON column into a set of channel IDs"""
+    if not value:
+        return None
+    return frozenset(int(channel) for channel in ujson.loads(value)) or None
+
+
+class WatchwordRegistry:
+    """
+    Every watched word with the IDs of the users watching it,
+    and the matcher built over those words.
+    Subscribers are kept in arrays of 64-bit IDs. Channel filters and
+    non-default cooldowns are only stored for the subscriptions that have one.
+    """
+
+    def __init__(self):
+        self.matcher = WatchwordMatcher()
+        self._subscribers = {}  # word -> array of user ids
+        self._channels = {}  # (word, user id) -> frozenset of channel ids
+        self._cooldowns = {}  # (word, user id) -> seconds between DMs
+        self._journal = None  # Changes made while a reload is running
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    @property
+    def subscription_count(self):
+        return sum(map(len, self._subscribers.values()))
+
+    def subscribers(self, word: str):
+        """Returns the IDs of the users watching word"""
+        return self._subscribers.get(word, ())
+
+    def subscriber_ids(self) -> set:
+        """Returns the IDs of everyone watching at least one word"""
+        return set().union(*self._subscribers.values())
+
+    def channels(self, word: str, user_id: int):
+        """Returns a subscription's channel filter, or None if unfiltered"""
+        return self._channels.get((word, user_id))
+
+    def watches_in(self, word: str, user_id: int, channel_id: int) -> bool:
+        """Returns whether a subscription's channel filter lets channel_id in"""
+        channels = self._channels.get((word, user_id))
+        return channels is None or channel_id in channels
+
+    def cooldown(self, word: str, user_id: int) -> int:
+        """Returns the minimum seconds between DMs for a subscription"""
+        return self._cooldowns.get((word, user_id), DEFAULT_COOLDOWN)
+
+    def is_watching(self, word: str, user_id: int) -> bool:
+        return user_id in self._subscribers.get(word, ())
+
+    def match(self, content: str, tokens=None) -> set:
+        """Returns the watched words found in content; see WatchwordMatcher"""
+        return self.matcher.match(content, tokens)
+
+    def add(self,
+            word: str,
+            user_id: int,
+            channels=None,
+            cooldown=DEFAULT_COOLDOWN) -> bool:
+        """Subscribes user_id to word; returns False if already subscribed"""
+        if self._journal is not None:
+            self._journal.append((True, word, user_id, channels, cooldown))
+        subscribers = self._subscribers.get(word)
+        if subscribers is None:
+            subscribers = self._subscribers[word] = array.array("Q")
+            self.matcher.add(word)
+        elif user_id in subscribers:
+            return False
+        subscribers.append(user_id)
+        if channels:
+            self._channels[(word, user_id)] = frozenset(channels)
+        if cooldown != DEFAULT_COOLDOWN:
+            self._cooldowns[(word, user_id)] = cooldown
+        return True
+
+    def remove(self, word: str, user_id: int) -> bool:
+        """Unsubscribes user_id from word; returns False if not subscribed"""
+        if self._journal is not None:
+            self._journal.append((False, word, user_id, None, None))
+        subscribers = self._subscribers.get(word)
+        if subscribers is None or user_id not in subscribers:
+            return False
+        subscribers.remove(user_id)
+        self._channels.pop((word, user_id), None)
+        self._cooldowns.pop((word, user_id), None)
+        if not subscribers:
+            del self._subscribers[word]
+            self.matcher.discard(word)
+        return True
+
+    async def reload(self, storage, guild_id: int):
+        """
+        Streams the guild's rows from the watchword table into fresh
+        structures and swaps them in, replaying any add/remove made while
+        the rows were loading. Works both at startup and on a live bot.
+        """
+        fresh = WatchwordRegistry()
+        self._journal = []
+        try:
+            async for user_id, word, channels, cooldown in storage.iterate(
+                    "SELECT user_id, word, channels, cooldown FROM watchword "
+                    "WHERE guild_id = ?;", (guild_id,)):
+                fresh.add(word, user_id, parse_channels(channels), cooldown)
+            for subscribing, word, user_id, channels, cooldown in self._journal:
+                if subscribing:
+                    fresh.add(word, user_id, channels, cooldown)
+                else:
+                    fresh.remove(word, user_id)
+        finally:
+            self._journal = None
+        self.matcher = fresh.matcher
+        self._subscribers = fresh._subscribers
+        self._channels = fresh._channels
+        self._cooldowns = fresh._cooldowns
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes held by the registry and its matcher"""
+        size = sys.getsizeof(self._subscribers) + sys.getsizeof(self._channels)
+        for word, subscribers in self._subscribers.items():
+            size += sys.getsizeof(word) + sys.getsizeof(subscribers)
+        for key, channels in self._channels.items():
+            size += sys.getsizeof(key) + sys.getsizeof(channels)
+        size += sys.getsizeof(self._cooldowns)
+        size += sum(map(sys.getsizeof, self._cooldowns))
+        return size + self.matcher.memory_footprint()
+
+
+class CooldownThrottle:
+    """
+    Remembers until when each (user, word) pair is cooling down.
+    Expiry times are also hashed into a timing wheel of slots buckets,
+    resolution seconds each. Every check sweeps only the buckets whose time
+    has passed, so checks are O(1) amortized and expired pairs are dropped
+    without scanning everything. Each pair sits in exactly one bucket, and
+    past max_entries the pair armed longest ago is forgotten early, which
+    keeps memory bounded under any load.
+    """
+
+    def __init__(self, resolution=10, slots=512, max_entries=100000):
+        self.resolution = resolution
+        self.slots = slots
+        self.max_entries = max_entries
+        self.allowed = 0
+        self.throttled = 0
+        self._until = {}  # key -> monotonic time it may fire again, oldest first
+        self._wheel = [set() for _ in range(slots)]
+        self._tick = None
+
+    def __len__(self):
+        return len(self._until)
+
+    def _slot(self, until) -> int:
+        return int(until // self.resolution) % self.slots
+
+    def _forget(self, key):
+        self._wheel[self._slot(self._until.pop(key))].discard(key)
+
+    def _sweep(self, now):
+        tick = int(now // self.resolution)
+        if self._tick is None:
+            self._tick = tick
+            return
+        for passed in range(self._tick + 1,
+                            min(tick, self._tick + self.slots) + 1):
+            slot = self._wheel[passed % self.slots]
+            # Keys due on a later turn of the wheel stay put
+            for key in [key for key in slot if self._until[key] <= now]:
+                slot.discard(key)
+                del self._until[key]
+        self._tick = max(tick, self._tick)
+
+    def allow(self, key, cooldown: float, now=None) -> bool:
+        """
+        Returns True and starts the cooldown if key isn't cooling down,
+        otherwise returns False.
+        """
+        if now is None:
+            now = time.monotonic()
+        self._sweep(now)
+        until = self._until.get(key)
+        if until is not None and until > now:
+            self.throttled += 1
+            return False
+        self.allowed += 1
+        if cooldown <= 0:
+            return True
+        if until is not None:
+            self._forget(key)  # Re-armed, so it moves to the newest end
+        elif len(self._until) >= self.max_entries:
+            self._forget(next(iter(self._until)))
+        until = self._until[key] = now + cooldown
+        self._wheel[self._slot(until)].add(key)
+        return True